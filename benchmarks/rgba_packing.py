@@ -0,0 +1,124 @@
+"""
+Wall time and peak RSS of building the Bokeh RGBA image from a GeoTIFF.
+
+Compares ``extract_image_data`` against the packing code it replaced, for
+3-band and 4-band uint8 and 3-band float32 rasters. Every case runs in a
+fresh interpreter so its peak RSS is not hidden by an earlier one. Usage:
+
+    python benchmarks/rgba_packing.py --size 6000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planner"))
+
+CASES = [("uint8", 3), ("uint8", 4), ("float32", 3)]
+
+
+def legacy_extract_image_data(src, downsample_factor=1):
+    """extract_image_data as it was before the packing kernel, for comparison."""
+    num_bands = src.count
+    height = src.height // downsample_factor
+    width = src.width // downsample_factor
+
+    if src.dtypes[0] == "uint8" and num_bands == 4:
+        bands = src.read(
+            [1, 2, 3, 4], out_shape=(num_bands, height, width), resampling=Resampling.bilinear
+        ).astype(np.uint8)
+        image = np.ascontiguousarray(np.transpose(bands, (1, 2, 0)))
+        return np.flipud(image.view(dtype=np.uint32).reshape(image.shape[:2]))
+
+    elif src.dtypes[0] == "uint8" and num_bands == 3:
+        r, g, b = src.read(
+            [1, 2, 3], out_shape=(num_bands, height, width), resampling=Resampling.bilinear
+        ).astype(np.uint8)
+        alpha = np.where((r == 0) & (g == 0) & (b == 0), 0, 255).astype(np.uint8)
+        image = np.dstack((r, g, b, alpha))
+        return np.flipud(image.view(dtype=np.uint32).reshape(image.shape[:2]))
+
+    else:
+        r, g, b = src.read(
+            [1, 2, 3], out_shape=(3, height, width), resampling=Resampling.bilinear
+        ).astype(np.float32)
+        r_norm = (r - np.min(r)) / (np.max(r) - np.min(r))
+        g_norm = (g - np.min(g)) / (np.max(g) - np.min(g))
+        b_norm = (b - np.min(b)) / (np.max(b) - np.min(b))
+        alpha = np.where((r == 0) & (g == 0) & (b == 0), 0, 1).astype(float)
+        image = np.dstack((r_norm, g_norm, b_norm, alpha))
+        return np.flipud((image * 255).astype(np.uint8).view(dtype=np.uint32).reshape(image.shape[:2]))
+
+
+def write_raster(path, size, dtype, count):
+    """Synthetic tiled GeoTIFF, written one row of blocks at a time."""
+    profile = dict(
+        driver="GTiff", width=size, height=size, count=count, dtype=dtype,
+        transform=from_origin(0, size, 1, 1), tiled=True, blockxsize=256, blockysize=256,
+    )
+    rng = np.random.default_rng(0)
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, size, 256):
+            rows = min(256, size - row)
+            block = rng.integers(0, 255, (count, rows, size)).astype(dtype)
+            dst.write(block, window=((row, row + rows), (0, size)))
+
+
+def run_case(impl, path, downsample_factor):
+    """Runs in the child: time one read and report the RSS it added."""
+    from utils.geo_utils import extract_image_data
+
+    func = extract_image_data if impl == "kernel" else legacy_extract_image_data
+    with rasterio.open(path) as src:
+        src.read(1, window=((0, 1), (0, 1)))  # Let GDAL set itself up before the baseline
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        image = func(src, downsample_factor)
+        seconds = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"seconds": seconds, "peak_rss_mb": (peak - baseline) / 1024, "output_mb": image.nbytes / 1024**2}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=4000, help="Edge length of the square test rasters")
+    parser.add_argument("--downsample", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--child", nargs=2, metavar=("IMPL", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_case(*args.child, args.downsample)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype, count in CASES:
+            path = os.path.join(tmp, f"{dtype}_{count}.tif")
+            write_raster(path, args.size, dtype, count)
+            for impl in ("legacy", "kernel"):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--size", str(args.size), "--downsample", str(args.downsample),
+                     "--child", impl, path],
+                    check=True, capture_output=True, text=True,
+                )
+                result = {"case": f"{dtype}x{count}", "impl": impl, "size": args.size, **json.loads(out.stdout)}
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print(
+                        f"{result['case']:<11} {impl:<7} {result['seconds'] * 1000:9.1f} ms"
+                        f"  peak +{result['peak_rss_mb']:8.1f} MB  (output {result['output_mb']:.1f} MB)"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Wall time and peak RSS of the planner's hot paths on synthetic inputs.
+
+Times ``process_geotiff`` and ``extract_image_data`` on every raster
+format and layout, ``calculate_index`` and ``compute_histogram`` once per
+raster size, and ``plan_traversal`` on waypoint sets of each size. Each
+case runs in a fresh interpreter so its peak RSS is its own, and results
+are JSON lines keyed by (bench, case), so runs from two commits can be
+compared. Usage:
+
+    python benchmarks/suite.py --out before.jsonl
+    git checkout my-branch
+    python benchmarks/suite.py --out after.jsonl
+    python benchmarks/suite.py --compare before.jsonl after.jsonl
+
+The defaults take a few minutes. ``--sizes 1000,4000,8000,16000,30000``
+covers the whole range, given the memory and about 11 GB of disk for the
+largest float32 rasters; add ``--data-dir`` to keep the generated inputs
+between runs.
+"""
+import argparse
+import importlib
+import inspect
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planner"))
+
+from synthetic import waypoints, write_raster
+
+SIZES = (1000, 4000)
+FORMATS = ("uint8x3", "uint8x4", "uint16x3", "float32x3")
+LAYOUTS = ("tiled", "striped")
+POINTS = (10, 100, 1000, 10_000, 100_000)
+INDEX_NAME = "VARI"
+
+# Child processes must not share results through the host-wide store, or
+# every run after the first would be a cache hit
+CHILD_ENV = {"PLANNER_SHARED_STORE_BYTES": "0"}
+
+
+def raster_path(data_dir, size, fmt, layout):
+    """Path of a synthetic raster, written on first use."""
+    dtype, count = fmt.split("x")
+    path = os.path.join(data_dir, f"{fmt}_{layout}_{size}.tif")
+    if not os.path.exists(path):
+        tmp = path + ".partial"
+        write_raster(tmp, size, dtype, int(count), layout == "tiled")
+        os.replace(tmp, path)
+    return path
+
+
+def normalized_bands(src, downsample_factor):
+    """RGB as float32 in [0, 1] plus the alpha mask, the way the index views get them."""
+    height, width = src.height // downsample_factor, src.width // downsample_factor
+    bands = src.read([1, 2, 3], out_shape=(3, height, width)).astype(np.float32)
+    alpha = (bands != 0).any(axis=0)
+    for band in bands:
+        low, high = band.min(), band.max()
+        band -= low
+        band /= (high - low) or 1
+    return bands, alpha
+
+
+def raw_index(index_name, bands):
+    """The float index the way the original calculate_index computed it, for trees without vegetation_index."""
+    r, g, b = bands
+    if index_name == "VARI":
+        return np.clip((g - r) / (g + r - b + 1e-6), -1, 1)
+    return np.clip((g - b) / (g + b + 1e-6), -1, 1)
+
+
+def run_case(spec):
+    """
+    Runs in the child: set up, then time ``spec["repeat"]`` calls and report the RSS they added.
+
+    Anything newer than the original geo_utils API is looked up rather than
+    imported, so the suite also runs against the commits it is meant to be
+    compared with.
+    """
+    import logging
+
+    from bokeh.models import ColumnDataSource
+
+    from utils.geo_utils import calculate_index, compute_histogram, extract_image_data, plan_traversal, process_geotiff
+
+    geo_utils = importlib.import_module("utils.geo_utils")
+    try:
+        raster_cache = getattr(importlib.import_module("utils.cache"), "RASTER_CACHE", None)
+    except ImportError:
+        raster_cache = None
+    open_raster = getattr(geo_utils, "open_raster", rasterio.open)
+    vegetation_index = getattr(geo_utils, "vegetation_index", raw_index)
+    plan_kwargs = {}
+    if "time_budget" in inspect.signature(plan_traversal).parameters:
+        plan_kwargs["time_budget"] = spec.get("budget")
+
+    bench = spec["bench"]
+    downsample_factor = spec.get("downsample", 1)
+    extra = {}
+    src = None
+    if bench == "process_geotiff":
+        logger = logging.getLogger("benchmark")
+        src = open_raster(spec["path"])  # The handle process_geotiff reuses, as on a warm server (if it does)
+        func = lambda: process_geotiff(spec["path"], logger, downsample_factor)
+    elif bench == "extract_image_data":
+        src = rasterio.open(spec["path"])
+        func = lambda: extract_image_data(src, downsample_factor)
+    elif bench in ("calculate_index", "compute_histogram"):
+        with rasterio.open(spec["path"]) as src:
+            bands, alpha = normalized_bands(src, downsample_factor)
+        src = None
+        if bench == "calculate_index":
+            func = lambda: calculate_index(INDEX_NAME, bands, alpha)
+        else:
+            index = vegetation_index(INDEX_NAME, bands)
+            func = lambda: compute_histogram(index)
+    elif bench == "plan_traversal":
+        x, y = waypoints(spec["points"])
+        marker_source = ColumnDataSource(data={"x": x, "y": y})
+        func = lambda: plan_traversal(marker_source, **plan_kwargs)
+    else:
+        raise ValueError(f"Unknown bench {bench}")
+
+    if src is not None:
+        src.read(1, window=((0, 1), (0, 1)))  # Let GDAL set itself up before the baseline
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = []
+    for _ in range(spec["repeat"]):
+        if raster_cache is not None:
+            raster_cache.clear()  # Every repeat does the full work
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+        if bench == "plan_traversal":
+            points = np.column_stack([x, y])
+            order = np.asarray(result)
+            extra["route_length"] = float(np.hypot(*np.diff(points[order], axis=0).T).sum())
+        del result
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "seconds": min(seconds),
+        "seconds_median": float(np.median(seconds)),
+        "peak_rss_mb": (peak - baseline) / 1024,
+        **extra,
+    }
+
+
+def cases(args, data_dir):
+    """(bench, case name, child spec) for everything selected on the command line."""
+    common = {"repeat": args.repeat, "downsample": args.downsample}
+    for size in args.sizes:
+        for fmt in args.formats:
+            for layout in args.layouts:
+                path = raster_path(data_dir, size, fmt, layout)
+                for bench in ("process_geotiff", "extract_image_data"):
+                    yield bench, f"{fmt}-{layout}-{size}", {"bench": bench, "path": path, **common}
+
+        # Index math works on normalized float bands, so format and layout don't matter
+        path = raster_path(data_dir, size, "uint8x3", "tiled")
+        for bench in ("calculate_index", "compute_histogram"):
+            yield bench, f"{INDEX_NAME}-{size}", {"bench": bench, "path": path, **common}
+
+    for points in args.points:
+        spec = {"bench": "plan_traversal", "points": points, "budget": args.plan_budget, **common}
+        yield "plan_traversal", f"{points}pts-{args.plan_budget:g}s", spec
+
+
+def git_commit():
+    """Short hash of the checked-out commit, with "+dirty" for uncommitted changes."""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, check=True, capture_output=True, text=True,
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+dirty" if dirty else "")
+
+
+def compare(base_path, new_path):
+    """Print each (bench, case) found in both result files with the change in time and memory."""
+    def load(path):
+        with open(path) as f:
+            return {(r["bench"], r["case"]): r for r in map(json.loads, f) if "bench" in r}
+
+    base, new = load(base_path), load(new_path)
+    print(f"{'bench':<19} {'case':<26} {'time':>21} {'ratio':>6} {'peak RSS MB':>23}")
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key], new[key]
+        ratio = n["seconds"] / b["seconds"] if b["seconds"] else float("nan")
+        print(
+            f"{key[0]:<19} {key[1]:<26} {b['seconds'] * 1000:8.1f} -> {n['seconds'] * 1000:8.1f} ms {ratio:6.2f}"
+            f" {b['peak_rss_mb']:9.1f} -> {n['peak_rss_mb']:9.1f}"
+        )
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"{key[0]:<19} {key[1]:<26} only in {base_path if key in base else new_path}")
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+def name_list(choices):
+    def parse(text):
+        names = [name for name in text.split(",") if name]
+        unknown = set(names) - set(choices)
+        if unknown:
+            raise argparse.ArgumentTypeError(f"unknown {', '.join(sorted(unknown))}, pick from {', '.join(choices)}")
+        return names
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int_list, default=list(SIZES), help="Raster edge lengths, comma separated")
+    parser.add_argument("--formats", type=name_list(FORMATS), default=list(FORMATS))
+    parser.add_argument("--layouts", type=name_list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument("--points", type=int_list, default=list(POINTS), help="Waypoint set sizes, comma separated")
+    parser.add_argument("--plan-budget", type=float, default=1.0, help="Local search seconds per plan")
+    parser.add_argument("--downsample", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="Calls per case; the fastest is reported")
+    parser.add_argument("--data-dir", help="Keep generated inputs here instead of a temporary directory")
+    parser.add_argument("--out", help="Append results to this JSON lines file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_case(json.loads(args.child))))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    meta = {"commit": git_commit(), "machine": platform.node(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__, "gdal": rasterio.__gdal_version__}
+    out = open(args.out, "a") if args.out else None
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        for bench, case, spec in cases(args, data_dir):
+            child = subprocess.run(
+                [sys.executable, __file__, "--child", json.dumps(spec)],
+                capture_output=True, text=True, env={**os.environ, **CHILD_ENV},
+            )
+            if child.returncode != 0:
+                # Most likely out of memory at the big sizes, keep going with the rest
+                print(f"{bench:<19} {case:<26} failed: {child.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+                continue
+
+            result = {"bench": bench, "case": case, **json.loads(child.stdout.splitlines()[-1]), **meta}
+            if out is not None:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            if args.json:
+                print(json.dumps(result))
+            else:
+                extra = f"  route {result['route_length']:.6g}" if "route_length" in result else ""
+                print(
+                    f"{bench:<19} {case:<26} {result['seconds'] * 1000:9.1f} ms"
+                    f"  peak +{result['peak_rss_mb']:8.1f} MB{extra}"
+                )
+    if out is not None:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
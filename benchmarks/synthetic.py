@@ -0,0 +1,111 @@
+"""
+Synthetic inputs for the benchmarks: GeoTIFFs and waypoint sets.
+
+Rasters are smooth colour gradients plus noise with a nodata border, so
+alpha, stretching and the vegetation indexes all have something to do, and
+every run with the same arguments writes the same pixels. They are written
+a strip at a time, so even 30k x 30k rasters never sit in memory. Usage:
+
+    python benchmarks/synthetic.py raster out.tif --size 8000 --dtype uint16 --count 4 --striped
+    python benchmarks/synthetic.py waypoints out.waypoints --points 10000
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planner"))
+
+BOUNDS = (-3.71, 40.40, -3.69, 40.415)  # Same corner of Madrid as the sample image, in WGS84
+BLOCK_SIZE = 256  # Tile edge for tiled rasters, and rows written at a time
+BORDER = 0.02  # Fraction of each edge left as nodata (all bands 0)
+
+# What a full-scale value is for each dtype: 8-bit, 12-bit sensor counts, reflectance
+FULL_SCALE = {"uint8": 255, "uint16": 4095, "float32": 1.0}
+
+
+def write_raster(path, size, dtype="uint8", count=3, tiled=True, seed=0):
+    """Square ``size`` x ``size`` GeoTIFF with ``count`` bands of ``dtype``, tiled or striped."""
+    profile = dict(
+        driver="GTiff", width=size, height=size, count=count, dtype=dtype, crs="EPSG:4326",
+        transform=from_bounds(*BOUNDS, size, size),
+    )
+    if tiled:
+        profile.update(tiled=True, blockxsize=BLOCK_SIZE, blockysize=BLOCK_SIZE)
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, size, dtype=np.float32)
+    border = int(size * BORDER)
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, size, BLOCK_SIZE):
+            rows = min(BLOCK_SIZE, size - row)
+            y = np.linspace(row / size, (row + rows) / size, rows, endpoint=False, dtype=np.float32)[:, None]
+            block = np.empty((count, rows, size), dtype=np.float32)
+            block[0] = 0.5 + 0.4 * np.sin(6 * x + 3 * y)  # Red
+            block[1] = 0.5 + 0.4 * np.cos(5 * x - 4 * y)  # Green, so VARI and GNDVI vary too
+            block[2] = 0.3 + 0.3 * x * y  # Blue
+            if count == 4:
+                block[3] = 1.0
+            block[:3] += rng.normal(0, 0.05, (3, rows, size)).astype(np.float32)
+            np.clip(block, 0, 1, out=block)
+            block *= FULL_SCALE[dtype]
+
+            # Nodata frame around the image
+            block[:, :, :border] = 0
+            block[:, :, size - border:] = 0
+            top, bottom = max(0, border - row), max(0, row + rows - (size - border))
+            block[:, :top] = 0
+            block[:, rows - bottom:] = 0
+            dst.write(block.astype(dtype), window=((row, row + rows), (0, size)))
+    return path
+
+
+def waypoints(num_points, seed=0):
+    """(x, y) arrays of ``num_points`` waypoints inside BOUNDS, half scattered, half in clumps."""
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = BOUNDS
+    scattered = num_points // 2
+    x = rng.uniform(left, right, num_points)
+    y = rng.uniform(bottom, top, num_points)
+
+    # The rest gather around a few centres, like survey grids dropped on fields
+    clumped = num_points - scattered
+    centres = rng.integers(0, max(1, scattered), max(1, num_points // 1000))
+    picks = centres[rng.integers(0, len(centres), clumped)]
+    x[scattered:] = x[picks] + rng.normal(0, (right - left) / 100, clumped)
+    y[scattered:] = y[picks] + rng.normal(0, (top - bottom) / 100, clumped)
+    return x, y
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="kind", required=True)
+
+    raster = sub.add_parser("raster", help="Write a synthetic GeoTIFF")
+    raster.add_argument("path")
+    raster.add_argument("--size", type=int, default=4000)
+    raster.add_argument("--dtype", choices=sorted(FULL_SCALE), default="uint8")
+    raster.add_argument("--count", type=int, choices=(3, 4), default=3)
+    raster.add_argument("--striped", action="store_true", help="Strips instead of 256 x 256 tiles")
+    raster.add_argument("--seed", type=int, default=0)
+
+    points = sub.add_parser("waypoints", help="Write a synthetic QGC WPL 110 mission")
+    points.add_argument("path")
+    points.add_argument("--points", type=int, default=1000)
+    points.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+    if args.kind == "raster":
+        write_raster(args.path, args.size, args.dtype, args.count, not args.striped, args.seed)
+    else:
+        from utils.mission import write_waypoints
+
+        x, y = waypoints(args.points, args.seed)
+        write_waypoints(args.path, {"x": x, "y": y})
+
+
+if __name__ == "__main__":
+    main()
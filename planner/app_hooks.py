@@ -1,11 +1,17 @@
+import time
+from functools import partial
 from bokeh.models import ColumnDataSource
 from bokeh.layouts import column, row
 from bokeh.io import curdoc
 from utils.logging_utils import setup_logger
 import logging
-from utils.geo_utils import process_geotiff
+from utils.tiles import tiles_enabled, pyramid_for_file
+from utils.viewport import ViewportImage
+from utils.sessions import SessionResources, session_resources, start_governor
+from utils.disk_cleanup import start_cleanup
+from utils.metrics import SESSION_CREATE_SECONDS, SESSIONS_CREATED, SESSIONS_DESTROYED
 from components.map import create_image_figure
-from components.planner import create_file_upload, create_data_col, add_image_tools
+from components.planner import create_file_upload, create_data_col, add_image_tools, create_coverage_controls
 
 tiff_file = "input/MADRID_RGB.tif"
 
@@ -16,6 +22,8 @@ def on_server_loaded(server_context):
 
     logger = setup_logger(name="waypoint_planner", log_level=logging.DEBUG)
     logger.info("Bokeh server has started!")
+    start_governor() # Evicts idle sessions' images and keeps the process in its memory budget
+    start_cleanup() # Deletes uploads and tile pyramids nobody has used in a while
     # initialize_data(server_context, logger) # Wrong, needs session context
     logger.info("Server startup completed.")
 
@@ -26,13 +34,25 @@ def initialize_data(server_context, logger):
     logger.info("Initializing data...")
     image_source = ColumnDataSource(data={"image": []})
     marker_source = ColumnDataSource(data={"x": [], "y": [], "label": []})
-
-    logger.debug("Processing initial GeoTIFF file.")
-    rgba_image, bounds = process_geotiff(tiff_file, logger)
-    image_source.data = {"image": [rgba_image], "bounds": [bounds]}
+    area_source = ColumnDataSource(data={"xs": [], "ys": []})
+
+    pyramid = None
+    viewport = None
+    if tiles_enabled():
+        logger.debug("Opening tile pyramid for initial GeoTIFF file.")
+        pyramid = pyramid_for_file(tiff_file, logger)
+        bounds = pyramid.bounds
+    else:
+        logger.debug("Reading initial GeoTIFF file at screen resolution.")
+        viewport = ViewportImage(image_source, logger)
+        bounds = viewport.open(tiff_file)
 
     setattr(server_context, 'image_source', image_source)
     setattr(server_context, 'marker_source', marker_source)
+    setattr(server_context, 'area_source', area_source)
+    setattr(server_context, 'image_bounds', bounds)
+    setattr(server_context, 'pyramid', pyramid)
+    setattr(server_context, 'viewport', viewport)
 
     logger.debug(f"Server document (on_server_loaded): {curdoc()}")
     logger.info("Data initialized.")
@@ -44,25 +64,59 @@ def on_session_created(session_context):
 
     logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
     logger.info(f'on_session_created: {id(session_context)}')
+    start = time.perf_counter()
 
     # server_context = session_context.server_context
+    session = SessionResources(session_context.id, logger)
     initialize_data(session_context, logger)
     image_source = getattr(session_context, 'image_source')
     marker_source = getattr(session_context, 'marker_source')
+    area_source = getattr(session_context, 'area_source')
+    bounds = getattr(session_context, 'image_bounds')
+    pyramid = getattr(session_context, 'pyramid')
+    viewport = getattr(session_context, 'viewport')
 
     # Create the session-specific layout
-    image_figure = create_image_figure(image_source) # Create a fresh image figure for this session
-    file_upload = create_file_upload(image_source, image_figure, logger)
+    image_figure = create_image_figure(image_source, bounds, pyramid) # Create a fresh image figure for this session
+    if viewport is not None:
+        viewport.watch(image_figure) # Re-read the visible window on pan/zoom
+    file_upload = create_file_upload(image_source, image_figure, logger, viewport, session)
 
     # Define layout and add to the document
     image_container = column(file_upload, image_figure)
     image_container.sizing_mode = "stretch_both"
-    add_image_tools(image_figure, marker_source)
+    add_image_tools(image_figure, marker_source, area_source)
 
-    data_col = create_data_col(image_figure, marker_source)
+    data_col = create_data_col(image_figure, marker_source, session)
+    data_col.children.append(create_coverage_controls(area_source, marker_source))
     planner_row = row(image_container, data_col)
     planner_row.sizing_mode = "stretch_both"
 
+    # The image can be dropped while the session is idle and re-read for the current view later
+    session.track(image_source, partial(viewport.refresh, image_figure) if viewport is not None else None)
+    session.track(marker_source)
+    session.track(area_source)
+
     setattr(session_context, 'planner_row', planner_row) # Pass to session, add to doc there
+    setattr(session_context, 'session_resources', session) # main.py attaches it to the document
+
+    SESSION_CREATE_SECONDS.observe(time.perf_counter() - start)
+    SESSIONS_CREATED.inc()
+    logger.info(f"on_session_created complete: {id(session_context)}")
+
+
+def on_session_destroyed(session_context):
+    """Release everything the session held as soon as its tab is gone."""
+
+    logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
+    session = session_resources(session_context.id)
+    if session is not None:
+        session.destroy() # Cancels upload and planning jobs, empties the sources
+    SESSIONS_DESTROYED.inc()
+
+    for name in ('image_source', 'marker_source', 'area_source', 'image_bounds', 'pyramid', 'viewport',
+                 'planner_row', 'session_resources'):
+        if hasattr(session_context, name):
+            delattr(session_context, name)
 
-    logger.info(f"on_session_created complete: {id(session_context)}")
\ No newline at end of file
+    logger.info(f"on_session_destroyed: {id(session_context)}")
\ No newline at end of file
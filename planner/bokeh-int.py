@@ -2,16 +2,20 @@ from bokeh.plotting import figure, curdoc
 from bokeh.models import (
     ColumnDataSource, Select, Slider, PointDrawTool, 
     RangeTool, Range1d, Div, DataTable, TableColumn, 
-    CustomJS, Button, CrosshairTool, FileInput
+    CustomJS, Button, CrosshairTool, FileInput, LinearColorMapper
 )
 from bokeh.layouts import column, row
 import base64
 from rasterio.io import MemoryFile
 import numpy as np
-from matplotlib import cm
 import os
 import logging
 from utils.logging_utils import setup_logger
+from utils.mission import write_waypoints
+from utils.cache import bytes_digest
+from utils.colormaps import PALETTE_HIGH, PALETTE_LEVELS, PALETTE_LOW, colormap_palette, rebin_counts
+from utils.geo_utils import index_layer
+from utils.scheduler import UpdateScheduler
 
 # Initialize the logger
 logger = setup_logger(name="my_project_logger", log_level=logging.DEBUG)
@@ -40,7 +44,7 @@ def fix_base64_padding(data: str) -> str:
 def process_geotiff(file_contents):
     """Process the uploaded GeoTIFF and update the plot."""
 
-    global r_norm, g_norm, b_norm, non_transparent_mask, rgba_image, alpha, bounds
+    global r_norm, g_norm, b_norm, non_transparent_mask, rgba_image, alpha, bounds, image_id
 
     decoded = None  # To hold the decoded or raw data
     # file_contents = fix_base64_padding(file_contents) # Fix padding before decoding
@@ -60,6 +64,8 @@ def process_geotiff(file_contents):
         logger.debug("Uploaded file without Base64 header.")
         decoded = base64.b64decode(file_contents)
 
+    image_id = bytes_digest(decoded)  # Keys this image's cached index layers
+
     # Memory read files
     # https://rasterio.readthedocs.io/en/latest/topics/memory-files.html#memoryfile-bytesio-meets-namedtemporaryfile
     with MemoryFile(decoded) as memfile:
@@ -122,33 +128,15 @@ def count_out_of_bounds_values(data, lower=-1, upper=1):
         print(f"Percentage of out-of-bounds values: {percentage_out_of_bounds:.2f}%")
 
 # Define vegetation index calculations
-def calculate_index(index_name, colormap_name="RdYlGn", lower_clip=None, upper_clip=None):
-    """Calculate vegetation index and return a normalized image."""
-    if index_name == "VARI":
-        index = (g_norm - r_norm) / (g_norm + r_norm - b_norm + 1e-6)
-    elif index_name == "GNDVI":
-        index = (g_norm - b_norm) / (g_norm + b_norm + 1e-6)
-    else:  # Default to RGB for the regular view
-        return rgba_image, None
-
-    # Normalize the index to [-1, 1] for visualization
-    index[~non_transparent_mask] = np.nan  # Set transparent regions to NaN
-    index_clipped = np.clip(index, -1, 1)  # Ensure values are in the range [-1, 1]
-
-    # Apply a colormap (e.g., viridis)
-    # =================================
-    if lower_clip is not None:
-        index[index < lower_clip] = -1
-    if upper_clip is not None:
-        index[index > upper_clip] = 1  
-
-    index_norm = (index + 1) / 2  # Normalize to [0, 1] for colormap    
-
-    colormap = cm.get_cmap(colormap_name)
-    colored_index = colormap(index_norm)  # Returns RGBA values (0-1)
-    colored_index[..., -1] = alpha  # Apply original transparency mask
-
-    return colored_index, index_clipped
+def calculate_index(index_name):
+    """
+    Vegetation index as uint8 codes for the browser to colormap, plus the
+    pixel count per code, as (codes, counts). None for the regular view.
+
+    Cached per image (geo_utils.index_layer), so switching back to an index
+    is free, and colormap or clip range changes never come here at all.
+    """
+    return index_layer(image_id, index_name, (r_norm, g_norm, b_norm), non_transparent_mask, levels=PALETTE_LEVELS)
 
 def to_bokeh_rgba(image):
     """Convert an RGBA array (float) to a uint32 array for Bokeh."""
@@ -161,20 +149,12 @@ def to_bokeh_rgba(image):
 # logger.debug(f"Current working directory: {os.getcwd()}")
 process_geotiff(tiff_file)
 initial_colormap = "RdYlGn"
-initial_image, initial_index = calculate_index("VARI")
-image_source = ColumnDataSource(data={"image": [to_bokeh_rgba(initial_image)]})
+initial_codes, initial_counts = calculate_index("VARI")
+hist, edges = rebin_counts(initial_counts)
+image_source = ColumnDataSource(data={"image": []})  # RGB for the regular view, only sent when shown
+index_source = ColumnDataSource(data={"image": [initial_codes]})  # Index codes, colored in the browser
 logger.debug("Initial image prepared.")
 
-
-# Compute histogram
-def compute_histogram(index_values):
-    """Compute a histogram of index values."""
-    if index_values is None:
-        return np.array([]), np.array([])
-    hist, edges = np.histogram(index_values, bins=125, range=(-1, 1))
-    return hist, edges
-
-hist, edges = compute_histogram(initial_index)
 hist_source = ColumnDataSource(data={"top": hist, "left": edges[:-1], "right": edges[1:]})
 
 
@@ -191,7 +171,7 @@ p = figure(
 )
 
 # Add the RGBA image to the plot
-p.image_rgba(
+rgba_renderer = p.image_rgba(
     image="image",
     source=image_source,
     x=bounds.left,
@@ -199,6 +179,18 @@ p.image_rgba(
     dw=bounds.right - bounds.left,
     dh=bounds.top - bounds.bottom,
 )
+
+# Index views: the codes are sent once, colormap and clip range are palette changes
+index_mapper = LinearColorMapper(palette=colormap_palette(initial_colormap), low=PALETTE_LOW, high=PALETTE_HIGH)
+index_renderer = p.image(
+    image="image",
+    source=index_source,
+    color_mapper=index_mapper,
+    x=bounds.left,
+    y=bounds.bottom,
+    dw=bounds.right - bounds.left,
+    dh=bounds.top - bounds.bottom,
+)
 p.output_backend = "webgl"
 crosshair = CrosshairTool()
 p.add_tools(crosshair)
@@ -266,9 +258,16 @@ range_display = Div(
     width=hist_figure.width, height=30,
 )
 
+# Range drags and quick dropdown changes fire far faster than anyone can see,
+# so callbacks queue refreshes here: at most one per interval, latest state only
+updates = UpdateScheduler(curdoc())
+
 # Callback to capture the selected range
 def update_range(attr, old, new):
     """Capture the selected range from the RangeTool."""
+    updates.request("range", refresh_range)
+
+def refresh_range():
     range_start = spectrum_range.x_range.start
     range_end = spectrum_range.x_range.end
     if range_start is not None and range_end is not None:
@@ -277,11 +276,13 @@ def update_range(attr, old, new):
             f"End = {range_end:.2f}"
         )
 
-        new_image, new_index = calculate_index(
-            view_select.value, color_select.value,
-            lower_clip=range_start, upper_clip=range_end
-        )
-        image_source.data = {"image": [to_bokeh_rgba(new_image)]}
+        update_palette()
+
+def update_palette():
+    """Recolor the index view in the browser. Values outside the selected range take the end colours."""
+    index_mapper.palette = colormap_palette(
+        color_select.value, spectrum_range.x_range.start, spectrum_range.x_range.end
+    )
 
 # Attach the callback to the RangeTool's x_range
 spectrum_range.x_range.on_change("start", update_range)
@@ -329,26 +330,12 @@ save_button = Button(label="Save to File", button_type="success")
 def save_to_file():
     """Save the current DataTable values to a waypoints file."""
     data = marker_source.data  # Get the data from the source
+    if len(data["x"]) == 0:
+        print("No points to save!")
+        return
 
     waypoints_filename = 'gen2.waypoints'
-    with open(waypoints_filename, 'w') as f:
-        # Write header for the MAVLink file (QGroundControl WPL version)
-        f.write("QGC WPL 110\n")  # Write header
-        
-        # Check if there's any data to write
-        num_points = len(data["x"])  # Number of rows
-        if num_points == 0:
-            print("No points to save!")
-            return
-
-        # Add home point (index 0)
-        # Home point command = 3, current WP = 1
-        f.write(f"0\t1\t0\t3\t0\t0\t0\t0\t{data['y'][0]}\t{data['x'][0]}\t100.000000\t1\n")
-
-        # Add waypoints starting from index 1 (regular waypoints)
-        for index in range(1, num_points):
-            # Waypoint command = 16
-            f.write(f"{index}\t0\t0\t16\t0\t0\t0\t0\t{data['y'][index]}\t{data['x'][index]}\t100.000000\t1\n")
+    write_waypoints(waypoints_filename, data)  # Home row first, altitude and command kept
 
     print(f"Waypoints have been exported to {waypoints_filename}")
 
@@ -364,11 +351,22 @@ view_select = Select(
 
 def update_image(attr, old, new):
     """Update the displayed image based on the selected view."""
-    new_image, new_index = calculate_index(view_select.value, color_select.value, spectrum_range.x_range.start)
-    image_source.data = {"image": [to_bokeh_rgba(new_image)]}
+    updates.request("view", refresh_image)
+
+def refresh_image():
+    layer = calculate_index(view_select.value)
+    if layer is None:
+        image_source.data = {"image": [to_bokeh_rgba(rgba_image)]}
+        hist, edges = np.array([]), np.array([])
+    else:
+        codes, counts = layer
+        hist, edges = rebin_counts(counts)  # No pass over the pixels
+        index_source.data = {"image": [codes]}
+        update_palette()
+    rgba_renderer.visible = layer is None
+    index_renderer.visible = layer is not None
 
     # Update histogram
-    hist, edges = compute_histogram(new_index)
     midpoints = (edges[:-1] + edges[1:]) / 2
     line_hist_source.data = {"x": midpoints, "y": hist}  # Update line graph source
 
@@ -387,8 +385,7 @@ color_select = Select(
 
 def update_colormap(attr, old, new):
     """Update the colormap of the image."""
-    new_image, new_index = calculate_index(view_select.value, color_select.value, spectrum_range.x_range.start)
-    image_source.data = {"image": [to_bokeh_rgba(new_image)]}
+    updates.request("colormap", update_palette)
 
 color_select.on_change("value", update_colormap)
 
@@ -1,12 +1,12 @@
 from bokeh.plotting import figure
-from bokeh.models import Range1d
+from bokeh.models import Range1d, TMSTileSource, TileRenderer, GlyphRenderer, ImageRGBA
 
+from utils.tiles import tile_url
 
 
-def create_image_figure(image_source):
-    """Create the Bokeh figure for displaying the image."""
 
-    bounds = image_source.data["bounds"][0]
+def create_image_figure(image_source, bounds, pyramid=None):
+    """Create the Bokeh figure for displaying the image."""
 
     p = figure(
         title="Interactive GeoTIFF Viewer",
@@ -19,15 +19,56 @@ def create_image_figure(image_source):
         # syncable=False, # Try to reduce network traffic
     )
 
-    # Add the RGBA image to the plot
-    p.image_rgba(
+    add_image_layer(p, image_source, bounds, pyramid)
+    p.output_backend = "webgl" # In theory helps us with performance
+    return p
+
+
+def add_image_layer(image_figure, image_source, bounds, pyramid=None):
+    """Draw the base image: as map tiles when a pyramid is given, else from image_source."""
+
+    if pyramid is not None:
+        # Custom tile grid anchored on the image's bottom-left corner, in its own CRS
+        tile_source = TMSTileSource(
+            url=tile_url(pyramid),
+            tile_size=pyramid.tile_size,
+            min_zoom=0,
+            max_zoom=pyramid.max_zoom,
+            initial_resolution=pyramid.initial_resolution,
+            x_origin_offset=-bounds.left,
+            y_origin_offset=-bounds.bottom,
+            wrap_around=False,
+        )
+        return image_figure.add_tile(tile_source)
+
+    # Add the RGBA image to the plot, placed wherever the viewport read put it
+    return image_figure.image_rgba(
         image="image",
         source=image_source,
-        x=bounds.left,
-        y=bounds.bottom,
-        dw=bounds.right - bounds.left,
-        dh=bounds.top - bounds.bottom,
+        x="x",
+        y="y",
+        dw="dw",
+        dh="dh",
         # syncable=False, # Try to reduce network traffic
     )
-    p.output_backend = "webgl" # In theory helps us with performance
-    return p
+
+
+def replace_image_layer(image_figure, image_source, bounds, pyramid=None):
+    """Swap out the figure's base image and reset the view onto the new one."""
+
+    # Get rid of possible previous image
+    image_figure.renderers = [
+        r for r in image_figure.renderers
+        if not (isinstance(r, TileRenderer) or (isinstance(r, GlyphRenderer) and isinstance(r.glyph, ImageRGBA)))
+    ]
+
+    # Add a new renderer with the updated image
+    add_image_layer(image_figure, image_source, bounds, pyramid)
+
+    image_figure.update(
+        x_range = Range1d(bounds.left, bounds.right),
+        y_range = Range1d(bounds.bottom, bounds.top)
+    )
+
+    # Make sure points on top of map image
+    image_figure.renderers = image_figure.renderers[-1:] + image_figure.renderers[:-1]
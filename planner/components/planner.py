@@ -1,56 +1,233 @@
 from bokeh.layouts import column, row
 from bokeh.models import (
     CrosshairTool, TableColumn, DataTable, CustomJS,
-    PointDrawTool, Button, Div, FileInput, Range1d, 
+    PointDrawTool, PolyDrawTool, Button, Div, FileInput, TextInput, Toggle,
+    NumericInput,
 )
 from bokeh.plotting import curdoc
+from bokeh.document import without_document_lock
+from bokeh.core.property.validation import without_property_validation
+from concurrent.futures import CancelledError
 from functools import partial
+import asyncio
+import base64
+import logging
+import threading
+import time
+import numpy as np
 
-from utils.geo_utils import process_geotiff, plan_traversal
+import config
+from utils.geo_utils import plan_traversal
+from utils.logging_utils import setup_logger
+from utils.routing import extend_tour, improve_tour, path_length, plan_route, repair_tour
+from utils.coverage import lawnmower
+from utils.mission import DEFAULTS, format_waypoints, parse_waypoints
+from utils.executor import decode_executor, plan_executor
+from utils.metrics import UPLOAD_SECONDS
+from utils.tiles import get_pyramid
+from utils.uploads import load_upload, load_file, spooled_upload, upload_url
+from components.map import replace_image_layer
 
-IMAGE_DOWNSAMPLE = 5 # Ratio by which size reduced 
 
+LIVE_MAX_MOVED = 3  # More points added or moved at once than this is a bulk edit, not a click or drag
 
-def create_file_upload(image_source, image_figure, logger):
-    # FileInput widget
-    file_upload = FileInput(accept=".tif,.tiff")
 
-    async def process_and_update(file_contents):
-        rgba_image, bounds = process_geotiff(file_contents, logger, downsample_factor=IMAGE_DOWNSAMPLE)
-        image_source.data = {"image": [rgba_image], "bounds": [bounds]}
-        logger.debug(f"Updated figure bounds to: x_range=({bounds.left}, {bounds.right}), y_range=({bounds.bottom}, {bounds.top})")
+def waypoint_labels(start, stop):
+    """Labels for waypoint rows ``start`` to ``stop``, numbered from 1 in flight order."""
+    return [str(i + 1) for i in range(start, stop)]
 
-        bounds = image_source.data["bounds"][0]
-        # image_figure = getattr(SERVER_CONTEXT, 'image_figure')
-
-        # Get rid of possible previous image
-        image_figure.renderers = [
-            r for r in image_figure.renderers if not isinstance(r, type(image_figure.image_rgba))
-        ]
-
-        # Add a new renderer with the updated image
-        image_figure.image_rgba(
-            image="image",
-            source=image_source,
-            x=bounds.left,
-            y=bounds.bottom,
-            dw=bounds.right - bounds.left,
-            dh=bounds.top - bounds.bottom,
-        )
 
-        image_figure.update(
-            x_range = Range1d(bounds.left, bounds.right),
-            y_range = Range1d(bounds.bottom, bounds.top)
-        )
-        # image_figure.x_range = Range1d(bounds.left, bounds.right) # Update the figure bounds
-        # image_figure.y_range = Range1d(bounds.bottom, bounds.top)
-        
-        # Make sure points on top of map image
-        image_figure.renderers = image_figure.renderers[-1:] + image_figure.renderers[:-1]
+@without_property_validation  # Otherwise every patch re-checks every row of every column
+def reorder_markers(marker_source, order):
+    """
+    Put marker_source rows in ``order``, sending the browser only the rows
+    that moved.
+
+    Labels are positional, so they stay where they are. A live-route repair
+    typically moves a handful of rows, which goes out as one small patch
+    rather than every column again. That saving is one way only: edits made
+    in the browser still come back as the whole source.
+    """
+    order = np.asarray(order)
+    moved = np.flatnonzero(order != np.arange(len(order)))
+    if len(moved) == 0:
+        return
+    span = slice(int(moved[0]), int(moved[-1]) + 1)
+    rows = order[span]
+    marker_source.patch({
+        key: [(span, np.asarray(column)[rows])]
+        for key, column in marker_source.data.items()
+        if key != "label"
+    })
+
+
+@without_property_validation
+def relabel_markers(marker_source, start=0):
+    """Fix labels from row ``start`` on, patching only the ones that are wrong."""
+    labels = marker_source.data["label"]
+    num_points = len(marker_source.data["x"])
+    first = next((i for i in range(start, num_points) if labels[i] != str(i + 1)), None)
+    if first is not None:
+        marker_source.patch({"label": [(slice(first, num_points), waypoint_labels(first, num_points))]})
+
+# Streams the picked file to the upload route, then hands the session its upload id
+js_stream_upload = """
+const input = document.createElement("input");
+input.type = "file";
+input.accept = ".tif,.tiff";
+input.onchange = () => {
+    const file = input.files[0];
+    if (!file) {
+        return;
+    }
+
+    const xhr = new XMLHttpRequest();
+    xhr.open("POST", url);
+    xhr.upload.onprogress = (event) => {
+        if (event.lengthComputable) {
+            status.text = `Uploading ${file.name}: ${Math.round(100 * event.loaded / event.total)}%`;
+        }
+    };
+    xhr.onload = () => {
+        if (xhr.status !== 200) {
+            status.text = `Upload of ${file.name} failed (${xhr.status})`;
+            return;
+        }
+        const {upload_id} = JSON.parse(xhr.responseText);
+        token.value = `${upload_id}:${Date.now()}:${file.name}`;  // Timestamp so re-uploads still fire
+    };
+    xhr.onerror = () => { status.text = `Upload of ${file.name} failed`; };
+
+    status.text = `Uploading ${file.name}...`;
+    xhr.send(file);  // Raw bytes, no Base64
+};
+input.click();
+"""
+
+# Downloads the mission text the server formatted, then clears it so the next save fires again
+js_download_mission = """
+const text = cb_obj.value;
+if (!text) {
+    return;
+}
+
+const blob = new Blob([text], { type: "text/plain" });
+const url = URL.createObjectURL(blob);
+
+// Create a temporary anchor element for download
+const a = document.createElement("a");
+a.href = url;
+a.download = "planned.waypoints";
+a.style.display = "none";
+document.body.appendChild(a);
+a.click();
+document.body.removeChild(a); // Cleanup
+URL.revokeObjectURL(url);
+
+cb_obj.value = "";  // Don't keep megabytes of text in the document
+"""
+
+
+def create_file_upload(image_source, image_figure, logger, viewport=None, session=None):
+    """
+    Upload widget plus a status line. Decoding runs in the decode executor, off the IO loop.
+
+    With ``session`` (utils.sessions.SessionResources), a queued upload job
+    is cancelled when the session closes.
+    """
+    upload_status = Div(text="", width=300)
+    jobs = {"latest": None}  # Newest upload job for this session, older ones are stale
+
+    def cancel_upload():
+        job, jobs["latest"] = jobs["latest"], None  # A running job finishes, but nothing is applied
+        if job is not None:
+            job.cancel()
+
+    if session is not None:
+        session.on_teardown(cancel_upload)
+
+    def apply_upload(job, filename, source, digest, bounds, view_image):
+        """Swap the new image into the document. Runs as a locked next-tick callback."""
+        if job is not jobs["latest"]:
+            return  # Superseded while waiting for the lock
+
+        if viewport is None:
+            # Only the pyramid was set up, browsers fetch the tiles they need
+            pyramid = get_pyramid(digest)
+        else:
+            pyramid = None
+            viewport.show(source, digest, bounds, view_image)
+        logger.debug(f"Updated figure bounds to: x_range=({bounds.left}, {bounds.right}), y_range=({bounds.bottom}, {bounds.top})")
 
+        replace_image_layer(image_figure, image_source, bounds, pyramid)
+        if viewport is not None:
+            viewport.watch(image_figure) # Fresh ranges need fresh listeners
+
+        upload_status.text = f"Loaded {filename}"
         logger.debug("Updated image figure")
         logger.debug(f"x_range=({image_figure.x_range.start}, {image_figure.x_range.end}), y_range=({image_figure.y_range.start}, {image_figure.y_range.end})")
 
+    def set_status(text):
+        upload_status.text = text
+
+    async def process_and_update(doc, load, upload, filename):
+        # A newer upload makes any queued or running one stale
+        stale = jobs["latest"]
+        if stale is not None and stale.cancel():
+            logger.debug("Cancelled stale upload job")
+
+        start = time.perf_counter()
+        job = jobs["latest"] = decode_executor().submit(load, upload, viewport is None)
+        try:
+            result = await asyncio.wrap_future(job)
+        except CancelledError:
+            UPLOAD_SECONDS.observe(time.perf_counter() - start, outcome="cancelled")
+            return
+        except Exception as e:
+            UPLOAD_SECONDS.observe(time.perf_counter() - start, outcome="failed")
+            logger.error(f"Error during file processing: {e}", exc_info=True)
+            if job is jobs["latest"]:
+                doc.add_next_tick_callback(partial(set_status, f"Could not read {filename}"))
+            return
+
+        UPLOAD_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+        if job is not jobs["latest"]:
+            logger.debug("Dropping result of stale upload job")  # Already running when superseded
+            return
+        doc.add_next_tick_callback(partial(apply_upload, job, filename, *result))
+
+
+    if upload_url() is not None:
+        # Streaming upload route is mounted, keep file bytes off the websocket entirely
+        upload_button = Button(label="Upload GeoTIFF", button_type="primary")
+        upload_token = TextInput(visible=False)  # JS drops "<upload id>:<timestamp>:<filename>" here
+        upload_button.js_on_click(CustomJS(
+            args=dict(url=upload_url(), status=upload_status, token=upload_token),
+            code=js_stream_upload,
+        ))
+
+        def token_callback(attr, old, new):
+            if not new:
+                return
+            parts = new.split(":", 2)
+            if len(parts) != 3:
+                logger.warning(f"Malformed upload token: {new!r}")
+                return
+            upload_id, _, filename = parts
+            source = spooled_upload(upload_id)
+            if source is None:
+                logger.warning(f"Unknown upload id: {upload_id}")
+                return
+
+            upload_status.text = f"Processing {filename}..."
+            doc = curdoc()
+            doc.add_next_tick_callback(without_document_lock(partial(process_and_update, doc, load_file, source, filename)))
+
+        upload_token.on_change("value", token_callback)
+        return row(upload_button, upload_status, upload_token)
+
+    # FileInput widget
+    file_upload = FileInput(accept=".tif,.tiff")
 
     # Callback for file upload
     def upload_callback(attr, old, new):
@@ -64,8 +241,11 @@ def create_file_upload(image_source, image_figure, logger):
                 return
             
             logger.debug(f"Uploaded file size: {len(file_contents) / (1024 * 1024):.2f} MB")            
-            curdoc().add_next_tick_callback(partial(process_and_update, file_contents=file_contents))
-            logger.debug("Image processing completed")
+            upload_status.text = f"Processing {file_upload.filename}..."
+            doc = curdoc()
+            doc.add_next_tick_callback(without_document_lock(
+                partial(process_and_update, doc, load_upload, file_contents, file_upload.filename)
+            ))
 
         except Exception as e:
             logger.error(f"Error during file upload: {e}", exc_info=True)
@@ -73,26 +253,37 @@ def create_file_upload(image_source, image_figure, logger):
     # Goes with file_input object
     file_upload.on_change("value", upload_callback)
 
-    return file_upload
+    return row(file_upload, upload_status)
 
 
-def add_image_tools(image_figure, marker_source):
+def add_image_tools(image_figure, marker_source, area_source=None):
     crosshair = CrosshairTool(line_alpha=0.7, line_color="aquamarine")
     image_figure.add_tools(crosshair)
 
+    # Survey area polygon, drawn under the markers
+    # ==================================================
+    if area_source is not None:
+        area = image_figure.patches(
+            xs="xs", ys="ys", source=area_source,
+            fill_color="aquamarine", fill_alpha=0.15, line_color="aquamarine", line_width=2,
+        )
+        image_figure.add_tools(PolyDrawTool(renderers=[area], num_objects=1))  # Drawing a new area replaces the old one
+
     # Create draggable markers
     # ==================================================
     points = image_figure.scatter(x="x", y="y", size=10, color="red", source=marker_source) # Add circle markers to the plot
     image_figure.line(x="x", y="y", source=marker_source, line_width=2, color="green")  # Line connecting points
     image_figure.text(x="x", y="y", text="label", source=marker_source, text_font_size="10pt", text_baseline="middle", color="yellow")
 
-    draw_tool = PointDrawTool(renderers=[points], empty_value="1")
+    # Waypoints added to a loaded mission get the usual altitude and command
+    draw_tool = PointDrawTool(renderers=[points], empty_value="1", default_overrides=dict(DEFAULTS))
     image_figure.add_tools(draw_tool)
     image_figure.toolbar.active_tap = draw_tool  # Set PointDrawTool as the active tool
 
 
 # @without_document_lock
-def create_data_col(image_figure, marker_source):
+def create_data_col(image_figure, marker_source, session=None):
+    logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
 
     # Div to display mouse coordinates
     # ==============================
@@ -107,89 +298,226 @@ def create_data_col(image_figure, marker_source):
     image_figure.js_on_event("mousemove", callback)
     
 
-    # Button to save mission data to file
+    # Mission files: formatted and parsed on the server in one go,
+    # so 100k-waypoint surveys don't freeze the browser
     # =====================================
-    js_save_file = """
-    const data = source.data;
-    let fileContent = "QGC WPL 110\\n";  // Header for the MAVLink file
-    const numPoints = data['x'].length; // Number of rows
+    mission_status = Div(text="", width=400)
+    mission_text = TextInput(visible=False)  # Carries the formatted file to the browser for download
+    mission_text.js_on_change("value", CustomJS(code=js_download_mission))
 
-    if (numPoints === 0) {
-        alert("No points to save!");
-        return;
-    }
+    def save_mission():
+        data = marker_source.data
+        if len(data["x"]) == 0:
+            mission_status.text = "No points to save!"
+            return
+        try:
+            mission_text.value = format_waypoints(data)
+        except ValueError as e:
+            logger.warning(f"Could not save mission: {e}")
+            mission_status.text = f"Not saved: {e}"
+            return
+        mission_status.text = f"Saved {len(data['x'])} waypoints"
 
-    // Add home point (index 0)
-    fileContent += `0\\t1\\t0\\t3\\t0\\t0\\t0\\t0\\t${data['y'][0]}\\t${data['x'][0]}\\t100.000000\\t1\\n`;
+    # Create a Bokeh Button
+    save_button = Button(label="Save Plan to File", button_type="success")
+    save_button.on_click(save_mission)
 
-    // Add waypoints starting from index 1
-    for (let i = 1; i < numPoints; i++) {
-        fileContent += `${i}\\t0\\t0\\t16\\t0\\t0\\t0\\t0\\t${data['y'][i]}\\t${data['x'][i]}\\t100.000000\\t1\\n`;
-    }
+    mission_input = FileInput(accept=".waypoints,.txt")
 
-    // Create a downloadable blob
-    const blob = new Blob([fileContent], { type: "text/plain" });
-    const url = URL.createObjectURL(blob);
-
-    // Create a temporary anchor element for download
-    const a = document.createElement("a");
-    a.href = url;
-    a.download = "planned.waypoints";
-    a.style.display = "none";
-    document.body.appendChild(a);
-    a.click();
-    document.body.removeChild(a); // Cleanup
-    URL.revokeObjectURL(url);
-    """
+    def load_mission(attr, old, new):
+        if not new:
+            return
+        try:
+            data = parse_waypoints(base64.b64decode(new).decode())
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"Could not load mission {mission_input.filename}: {e}")
+            mission_status.text = f"Could not read {mission_input.filename}"
+            return
+        marker_source.data = data  # One bulk update, mission columns ride along for the next save
+        mission_status.text = f"Loaded {len(data['x'])} waypoints from {mission_input.filename}"
 
-    # Create a Bokeh Button
-    save_button = Button(label="Save Plan to File", button_type="success")
-    file_download = CustomJS(args=dict(source=marker_source), code=js_save_file)
-    save_button.js_on_click(file_download) # Attach the JS callback to the button
+    mission_input.on_change("value", load_mission)
 
 
     # Traveling salesman solver
     # ======================================
-    def update_marker_source_with_path(marker_source):
-        """
-        Update marker_source with the traversal path.
+    # Plans run on the plan executor, the session only takes the document
+    # lock to show progress and to apply the final order.
+    route_status = Div(text="", width=400)
+    planning = {"cancel": None}  # Cancel event of the plan in flight, if any
 
-        Parameters:
-            marker_source: ColumnDataSource
-                The source containing x, y, and label of points.
-        """
-        # Get the optimal path
-        traversal_order = plan_traversal(marker_source)
+    def show_progress(cancel, length):
+        if cancel is planning["cancel"]:
+            route_status.text = f"Planning... best route so far: {length:.6g} map units"
+
+    def finish_planning(cancel, snapshot, initial, traversal_order):
+        """Apply a finished plan. Runs as a locked next-tick callback."""
+        planning["cancel"] = None
+        plan_button.disabled = False
+        cancel_button.disabled = True
 
-        # Reorder data based on traversal path
         data = marker_source.data
-        new_data = {
-            "x": [data["x"][i] for i in traversal_order],
-            "y": [data["y"][i] for i in traversal_order],
-            "label": [data["label"][i] for i in traversal_order],
-        }
+        if not (np.array_equal(data["x"], snapshot["x"]) and np.array_equal(data["y"], snapshot["y"])):
+            route_status.text = "Waypoints changed while planning, plan discarded"
+            return
+
+        points = np.column_stack([snapshot["x"], snapshot["y"]])
+        before = path_length(points, range(len(points)))
+        after = path_length(points, traversal_order)
+        stopped = " (cancelled)" if cancel.is_set() else ""
+        logger.info(f"Traversal of {len(points)} points: initial {initial:.6g}, improved {after:.6g}{stopped}")
+
+        apply_order(traversal_order)
+        route_status.text = f"Route length: {before:.6g} &rarr; {after:.6g} map units{stopped}"
+
+    def fail_planning(cancel):
+        if cancel is planning["cancel"]:
+            planning["cancel"] = None
+            plan_button.disabled = False
+            cancel_button.disabled = True
+            route_status.text = "Planning failed"
+
+    async def plan_in_background(doc, cancel, snapshot):
+        points = np.column_stack([snapshot["x"], snapshot["y"]])
+        lengths = []
+
+        def progress(length):
+            # Called on the planning thread, add_next_tick_callback is safe from there
+            lengths.append(length)
+            doc.add_next_tick_callback(partial(show_progress, cancel, length))
+
+        budget = config.TSP_TIME_BUDGET_MS / 1000
+        job = plan_executor().submit(plan_route, points, budget, progress, cancel)
+        try:
+            traversal_order = await asyncio.wrap_future(job)
+        except Exception as e:
+            logger.error(f"Error during route planning: {e}", exc_info=True)
+            doc.add_next_tick_callback(partial(fail_planning, cancel))
+            return
+        doc.add_next_tick_callback(partial(finish_planning, cancel, snapshot, lengths[0], traversal_order))
 
-        # Update the ColumnDataSource
-        marker_source.data = new_data
+    def start_planning():
+        """Plan the current waypoints in the background. Needs the document lock."""
+        data = marker_source.data
+        if planning["cancel"] is not None:
+            return  # One plan per session at a time
+        if len(data["x"]) < 4:
+            # Nothing to search, the greedy route is instant
+            apply_order(plan_traversal(marker_source))
+            return
+
+        cancel = planning["cancel"] = threading.Event()
+        snapshot = {"x": np.array(data["x"], dtype=float), "y": np.array(data["y"], dtype=float)}
+        plan_button.disabled = True
+        cancel_button.disabled = False
+        route_status.text = "Planning..."
+        doc = curdoc()
+        # Bokeh only sees the nolock marker on the callback itself, so wrap the partial, not the function
+        doc.add_next_tick_callback(without_document_lock(partial(plan_in_background, doc, cancel, snapshot)))
+
+    def on_cancel_click():
+        if planning["cancel"] is not None:
+            planning["cancel"].set()  # The search stops at its next step and hands back its best route
+            route_status.text = "Stopping, keeping the best route so far..."
 
     # Attach callback to button
     def on_plan_click():
-        update_marker_source_with_path(marker_source)
+        start_planning()
+
+    def stop_planning():
+        if planning["cancel"] is not None:
+            planning["cancel"].set()  # Frees the plan worker for other sessions
+
+    if session is not None:
+        session.on_teardown(stop_planning)
 
     plan_button = Button(label="Plan Shortest Traversal", button_type="primary")
     plan_button.on_click(on_plan_click)
+    cancel_button = Button(label="Stop", button_type="default", disabled=True)
+    cancel_button.on_click(on_cancel_click)
+
+    # Live route: keep the order good while points are added or dragged,
+    # without replanning from scratch on every edit
+    live_toggle = Toggle(label="Live Route", button_type="default", active=False)
+
+    # Last positions seen, to tell a click or drag from a bulk edit. Our own
+    # patches set "applying" so they don't come back round as edits.
+    known = {"x": np.empty(0), "y": np.empty(0), "applying": False}
+
+    def remember_markers():
+        known["x"] = np.array(marker_source.data["x"], dtype=float)
+        known["y"] = np.array(marker_source.data["y"], dtype=float)
+
+    def apply_order(order):
+        known["applying"] = True
+        try:
+            reorder_markers(marker_source, order)
+        finally:
+            known["applying"] = False
+        remember_markers()
+
+    def on_markers_changed(attr, old, new):
+        # The draw tool sends every column on each edit, so this compares the full
+        # arrays with what we knew; only our replies to the browser are patches
+        if known["applying"]:
+            return
+
+        xs = np.asarray(new["x"], dtype=float)
+        ys = np.asarray(new["y"], dtype=float)
+        known_x, known_y = known["x"], known["y"]
+        num_known = len(known_x)
+
+        # Points the draw tool adds arrive labelled "1", deleting one shifts the rest
+        known["applying"] = True
+        try:
+            relabel_markers(marker_source, num_known if len(xs) >= num_known else 0)
+        finally:
+            known["applying"] = False
+
+        if not live_toggle.active:
+            remember_markers()
+            return
+
+        points = np.column_stack([xs, ys])
+        budget = config.TSP_LIVE_BUDGET_MS / 1000
+
+        order = None
+        if (0 < len(xs) - num_known <= LIVE_MAX_MOVED
+                and np.array_equal(xs[:num_known], known_x) and np.array_equal(ys[:num_known], known_y)):
+            # New points land at the end, slot each one in where it costs least
+            added = list(range(num_known, len(xs)))
+            order = improve_tour(points, extend_tour(points, range(num_known), added), budget, focus=added)
+        elif len(xs) == num_known:
+            moved = np.flatnonzero((xs != known_x) | (ys != known_y)).tolist()
+            if 0 < len(moved) <= LIVE_MAX_MOVED:  # A drag, not a reorder or bulk edit
+                order = repair_tour(points, range(num_known), moved, budget)
+
+        if order is not None:
+            apply_order(order)
+        else:
+            remember_markers()
+
+    def on_live_toggle(attr, old, new):
+        remember_markers()
+        if new:
+            start_planning()  # Start from a planned route
+
+    marker_source.on_change("data", on_markers_changed)
+    live_toggle.on_change("active", on_live_toggle)
 
     # Callback to clear all waypoints
     def clear_all_waypoints():
-        marker_source.data = {"x": [], "y": [], "label": []}
+        marker_source.data = {"x": np.empty(0), "y": np.empty(0), "label": []}
 
     # Callback to delete the last waypoint
     def delete_last_waypoint():
-        if len(marker_source.data["x"]) > 0:
+        # Bokeh can't drop rows in place, so this is a full update, but as binary arrays
+        data = marker_source.data
+        if len(data["x"]) > 0:
+            # Every column, including altitude and command from a loaded mission
             marker_source.data = {
-                "x": marker_source.data["x"][:-1],
-                "y": marker_source.data["y"][:-1],
-                "label": marker_source.data["label"][:-1],
+                key: column[:-1] if key == "label" else np.asarray(column)[:-1]
+                for key, column in data.items()
             }
 
 
@@ -211,28 +539,17 @@ def create_data_col(image_figure, marker_source):
     ]
     data_table = DataTable(source=marker_source, columns=columns, width=400, height=280)
 
-    # CustomJS to number points incrementally
-    # Good: Faster to handle this in the browser
-    js_callback = CustomJS(args=dict(source=marker_source), code="""
-        const data = source.data;
-        const labels = data['label'];
-        for (let i = 0; i < data['x'].length; i++) {
-            labels[i] = (i + 1).toString();  // Incremental numbering starts from 1
-        }
-        source.change.emit();  // Trigger update
-    """)
-    marker_source.js_on_change('data', js_callback)
-
 
     # Organize interactive image into a column layout
     # ===============================================
     # image_container = column(image_figure)
     # image_container.sizing_mode = "stretch_both"
 
-    route_buttons = row(plan_button, save_button)
+    route_buttons = row(plan_button, cancel_button, live_toggle, save_button)
     point_buttons = row(delete_button, clear_button)
+    mission_row = row(mission_input, mission_text)
 
-    data_col = column(coords_display, route_buttons, point_buttons, data_table)
+    data_col = column(coords_display, route_buttons, route_status, point_buttons, mission_row, mission_status, data_table)
     data_col.width = 400
     data_col.min_width = 400
     data_col.sizing_mode = "scale_height"
@@ -242,3 +559,38 @@ def create_data_col(image_figure, marker_source):
     return data_col
 
 
+
+
+def create_coverage_controls(area_source, marker_source):
+    """Widgets that fill the drawn survey area with back-and-forth waypoints."""
+    spacing_input = NumericInput(title="Line spacing (map units)", mode="float", placeholder="auto", width=190)
+    heading_input = NumericInput(title="Heading (deg from north)", mode="float", value=0, width=190)
+    overlap_input = NumericInput(title="Side overlap (0-0.95)", mode="float", value=0, low=0, high=0.95, width=190)
+    margin_input = NumericInput(title="Turn margin (map units)", mode="float", value=0, low=0, width=190)
+    survey_status = Div(text="Draw the survey area with the polygon tool.", width=400)
+
+    def on_generate_click():
+        if not area_source.data["xs"]:
+            survey_status.text = "Draw the survey area first."
+            return
+
+        x, y = lawnmower(
+            area_source.data["xs"][0], area_source.data["ys"][0],
+            spacing=spacing_input.value,
+            heading=heading_input.value or 0.0,
+            overlap=overlap_input.value or 0.0,
+            turn_margin=margin_input.value or 0.0,
+        )
+        # One bulk update for the whole survey, however many waypoints
+        marker_source.data = {"x": x, "y": y, "label": waypoint_labels(0, len(x))}
+        survey_status.text = f"Generated {len(x)} waypoints."
+
+    generate_button = Button(label="Generate Survey", button_type="primary")
+    generate_button.on_click(on_generate_click)
+
+    return column(
+        row(spacing_input, heading_input),
+        row(overlap_input, margin_input),
+        generate_button,
+        survey_status,
+    )
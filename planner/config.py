@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+# Server-wide knobs. Everything can be overridden from the environment so the
+# Docker image can be tuned without a rebuild.
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+# Tile pyramid
+# ==================================================
+TILE_SIZE = _env_int("PLANNER_TILE_SIZE", 256)  # Pixels per tile edge
+TILE_CACHE_DIR = os.environ.get("PLANNER_TILE_DIR", os.path.join(tempfile.gettempdir(), "planner-tiles"))
+TILE_PRECOMPUTE_LEVELS = _env_int("PLANNER_TILE_PRECOMPUTE_LEVELS", 3)  # Coarse levels rendered up front
+TILE_WORKERS = _env_int("PLANNER_TILE_WORKERS", 4)  # Threads rendering tiles for the tile endpoint
+TILE_MAX_AGE_SECONDS = _env_int("PLANNER_TILE_MAX_AGE_SECONDS", 7 * 24 * 3600)  # Pyramids unused this long are deleted
+TILE_DIR_MAX_BYTES = _env_int("PLANNER_TILE_DIR_BYTES", 10 * 1024**3)  # Least recently used pyramids go past this
+
+# Uploads
+# ==================================================
+UPLOAD_DIR = os.environ.get("PLANNER_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "planner-uploads"))
+UPLOAD_MAX_BYTES = _env_int("PLANNER_UPLOAD_MAX_BYTES", 4 * 1024**3)  # Largest body the streaming upload route accepts
+UPLOAD_MAX_AGE_SECONDS = _env_int("PLANNER_UPLOAD_MAX_AGE_SECONDS", 24 * 3600)  # Uploads unused this long are deleted
+UPLOAD_DIR_MAX_BYTES = _env_int("PLANNER_UPLOAD_DIR_BYTES", 20 * 1024**3)  # Least recently used uploads go past this
+
+# Viewport rendering (used when the tile route is not mounted)
+# ==================================================
+VIEWPORT_DEBOUNCE_MS = _env_int("PLANNER_VIEWPORT_DEBOUNCE_MS", 200)  # Quiet time after a pan/zoom before re-reading
+VIEWPORT_WIDTH = _env_int("PLANNER_VIEWPORT_WIDTH", 1600)  # Screen size assumed until the browser reports it
+VIEWPORT_HEIGHT = _env_int("PLANNER_VIEWPORT_HEIGHT", 1200)
+
+# Display stretch for non-uint8 imagery
+# ==================================================
+STRETCH_PERCENT = _env_float("PLANNER_STRETCH_PERCENT", 0.0)  # Clip this much off each end of every band, 0 is plain min/max
+STATS_MAX_BLOCKS = _env_int("PLANNER_STATS_MAX_BLOCKS", 1024)  # Blocks sampled for band stats, 0 reads them all
+
+# Vegetation index views
+# ==================================================
+HISTOGRAM_MAX_PIXELS = _env_int("PLANNER_HISTOGRAM_MAX_PIXELS", 0)  # Above this, estimate the index histogram from a sample, 0 counts every pixel
+UPDATE_INTERVAL_MS = _env_int("PLANNER_UPDATE_INTERVAL_MS", 50)  # Least time between coalesced view refreshes in a session
+
+# Sessions
+# ==================================================
+SESSION_MEMORY_BYTES = _env_int("PLANNER_SESSION_MEMORY_BYTES", 512 * 1024 * 1024)  # Session buffers per server process before the least active are evicted
+SESSION_IDLE_SECONDS = _env_int("PLANNER_SESSION_IDLE_SECONDS", 300)  # Sessions untouched this long lose their image until they are used again
+
+# Route planning
+# ==================================================
+TSP_TIME_BUDGET_MS = _env_int("PLANNER_TSP_TIME_BUDGET_MS", 5000)  # Local search time after the initial route
+TSP_LIVE_BUDGET_MS = _env_int("PLANNER_TSP_LIVE_BUDGET_MS", 50)  # Local repair time per edit in live route mode
+TSP_DENSE_MAX_POINTS = _env_int("PLANNER_TSP_DENSE_MAX_POINTS", 2000)  # Above this, skip the n x n distance matrix
+
+# Caches
+# ==================================================
+RASTER_CACHE_BYTES = _env_int("PLANNER_RASTER_CACHE_BYTES", 256 * 1024 * 1024)  # Decoded rasters shared by all sessions
+INDEX_CACHE_BYTES = _env_int("PLANNER_INDEX_CACHE_BYTES", 256 * 1024 * 1024)  # Quantized vegetation index layers
+VIEW_CACHE_BYTES = _env_int("PLANNER_VIEW_CACHE_BYTES", 64 * 1024 * 1024)  # Pan/zoom crops, private to each process
+SHARED_STORE_DIR = os.environ.get(
+    "PLANNER_SHARED_STORE_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "planner-shared"),
+)  # Memory-mapped rasters and index layers shared by every server process on the host
+SHARED_STORE_BYTES = _env_int("PLANNER_SHARED_STORE_BYTES", 1024 * 1024 * 1024)  # Capped by free space there. 0 keeps caches private to each process
+GDAL_CACHE_MB = _env_int("PLANNER_GDAL_CACHE_MB", 128)  # GDAL block cache, shared by every dataset in the process
+
+# GDAL reads this lazily on first use, and spawned workers inherit it. An explicit GDAL_CACHEMAX wins.
+os.environ.setdefault("GDAL_CACHEMAX", str(GDAL_CACHE_MB))
+
+# Background work
+# ==================================================
+DECODE_EXECUTOR = os.environ.get("PLANNER_DECODE_EXECUTOR", "thread")  # "thread" or "process"
+DECODE_WORKERS = _env_int("PLANNER_DECODE_WORKERS", 2)
+PLAN_WORKERS = _env_int("PLANNER_PLAN_WORKERS", 2)  # Route plans running at once across all sessions
+INDEX_WORKERS = _env_int("PLANNER_INDEX_WORKERS", os.cpu_count() or 1)  # Threads sharing each vegetation index computation
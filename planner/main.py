@@ -1,5 +1,6 @@
 from bokeh.plotting import curdoc
 from utils.logging_utils import setup_logger
+from utils.metrics import watch_source_updates
 import logging
 
 SESSION_CONTEXT = curdoc().session_context
@@ -8,6 +9,8 @@ logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
 # Full document layout setup in app_hooks.py
 planner_row = getattr(SESSION_CONTEXT, 'planner_row')
 curdoc().add_root(planner_row)
+getattr(SESSION_CONTEXT, 'session_resources').attach(curdoc()) # Activity tracking for the session governor
+watch_source_updates(curdoc()) # Bytes pushed per data source update, for /metrics
 
 logger.debug(f"Main document (main.py): {curdoc()}")
 logger.info("Session document built!")
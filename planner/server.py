@@ -0,0 +1,68 @@
+"""
+Run the planner app on a Bokeh server with our extra Tornado routes mounted.
+
+`bokeh serve planner` still works, but has no way to add routes, so the app
+falls back to pushing images and uploads over the websocket. Usage:
+
+    python planner/server.py --show
+"""
+import argparse
+import logging
+import os
+import sys
+
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.server.server import Server
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)  # Same import root the app modules see under `bokeh serve`
+
+from utils.logging_utils import setup_logger
+from utils.metrics import metrics_patterns
+from utils.tiles import tile_patterns
+from utils.uploads import upload_patterns
+
+
+def extra_patterns(prefix=""):
+    """All non-Bokeh routes served alongside the app."""
+    return tile_patterns(prefix) + upload_patterns(prefix) + metrics_patterns()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the waypoint planner.")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--address", default=None)
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--num-procs", type=int, default=1)
+    parser.add_argument("--allow-websocket-origin", action="append", default=None)
+    parser.add_argument("--websocket-max-message-size", type=int, default=20 * 1024 * 1024)
+    parser.add_argument("--show", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
+
+    app_name = os.path.basename(APP_DIR)
+    server = Server(
+        {f"/{app_name}": Application(DirectoryHandler(filename=APP_DIR))},
+        port=args.port,
+        address=args.address,
+        prefix=args.prefix,
+        num_procs=args.num_procs,
+        allow_websocket_origin=args.allow_websocket_origin,
+        websocket_max_message_size=args.websocket_max_message_size,
+        extra_patterns=extra_patterns(args.prefix),
+    )
+    server.start()
+    logger.info(f"Serving /{app_name} on port {server.port}")
+
+    if args.show:
+        server.io_loop.add_callback(server.show, f"/{app_name}")
+    server.io_loop.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from utils.shared_store import open_shared_store
+
+# Process-wide caches shared by every session on this server process, backed
+# by a host-wide store so other server and decode processes share them too.
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded by the total byte size of its values.
+
+    The least recently used entries are evicted once ``max_bytes`` is
+    exceeded. Cached arrays are marked read-only since several sessions end up
+    holding the same object.
+
+    With a ``shared`` SharedStore, misses are looked up there before being
+    created, and new values are saved there and cached as read-only memory
+    maps, so every process on the host sees one copy. ``name`` keeps the
+    keys of caches sharing a store apart.
+    """
+
+    def __init__(self, max_bytes, shared=None, name=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.name = name
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        if self.shared is not None:
+            value = self.shared.get((self.name, key))
+            if value is not None:
+                return self._put_local(key, value, _sizeof(value))
+        return default
+
+    def put(self, key, value, nbytes=None):
+        nbytes = _sizeof(value) if nbytes is None else nbytes
+        if self.shared is not None:
+            value = self.shared.put((self.name, key), value)
+        return self._put_local(key, value, nbytes)
+
+    def _put_local(self, key, value, nbytes):
+        if nbytes > self.max_bytes:
+            return value  # Would evict everything else, just hand it back
+        _freeze(value)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+        return value
+
+    def get_or_create(self, key, create):
+        """Cached value for ``key``, calling ``create()`` to fill it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, create())
+        return value
+
+    def holds(self, array):
+        """Whether ``array`` is, or is a view of, an array cached here."""
+        with self._lock:
+            cached = {id(a) for value, _ in self._entries.values() for a in _arrays(value)}
+        while isinstance(array, np.ndarray):
+            if id(array) in cached:
+                return True
+            array = array.base
+        return False
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+def _sizeof(value):
+    """Bytes held by the arrays in a value (an array or a tuple/list of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(v) for v in value)
+    return 0
+
+
+def _arrays(value):
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            yield from _arrays(v)
+
+
+def _freeze(value):
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _freeze(v)
+
+
+# Memory-mapped files every process on the host attaches to, unless turned off
+SHARED_STORE = open_shared_store(config.SHARED_STORE_DIR, config.SHARED_STORE_BYTES)
+
+# Decoded/packed rasters, keyed by (content digest, how it was read)
+RASTER_CACHE = LRUCache(config.RASTER_CACHE_BYTES, SHARED_STORE, "raster")
+
+# Viewport crops read on pan and zoom. They almost never repeat across
+# sessions, so they stay out of the shared store and can't push out what
+# really is shared there.
+VIEW_CACHE = LRUCache(config.VIEW_CACHE_BYTES)
+
+# Quantized vegetation index layers, keyed by (image id, index name, resolution, levels)
+INDEX_CACHE = LRUCache(config.INDEX_CACHE_BYTES, SHARED_STORE, "index")
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def bytes_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path):
+    """
+    Content hash of a file, streamed in chunks.
+
+    Remembered per (path, size, mtime) so each file is only hashed once per
+    process, however many sessions open it.
+    """
+    stat = os.stat(path)
+    stamp = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(stamp)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return remember_file_digest(path, hasher.hexdigest())
+
+
+def remember_file_digest(path, digest):
+    """Record a digest computed while the file was being written, saving a re-read."""
+    stat = os.stat(path)
+    with _digests_lock:
+        _digests[(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)] = digest
+    return digest
@@ -0,0 +1,126 @@
+from functools import lru_cache
+
+import numpy as np
+from matplotlib import colormaps
+
+# Vegetation index rendering. Index values in [-1, 1] are quantized to small
+# integer codes once, and each colormap becomes a lookup table of packed RGBA
+# with one entry per code. Recoloring or reclipping is then a single gather
+# straight into the Bokeh uint32 image, instead of evaluating the colormap
+# into an H x W x 4 float64 array (16x the memory of uint16 codes) each time.
+
+INDEX_LEVELS = 4096  # Codes across [-1, 1]. 255 or fewer keeps codes in uint8.
+LUT_CACHE_SIZE = 64  # Colormap / clip range combinations kept
+
+
+def code_dtype(levels):
+    """Smallest unsigned dtype holding ``levels`` codes plus the transparent one."""
+    return np.uint8 if levels < 256 else np.uint16
+
+
+def quantize_index(index, valid=None, levels=INDEX_LEVELS, out=None, overwrite=False):
+    """
+    Integer codes for index values in [-1, 1], ``levels`` evenly spaced bins.
+
+    Values outside [-1, 1] take the end codes. NaNs, and pixels where
+    ``valid`` is False, get code ``levels``, which every lookup table maps to
+    transparent. ``out`` may be a flipped view, to write rows in Bokeh order.
+    With ``overwrite`` the scaling happens in ``index`` itself.
+    """
+    if overwrite:
+        scaled = index
+        scaled += 1
+        scaled *= levels / 2
+    else:
+        scaled = (index + 1) * (levels / 2)
+    invalid = np.isnan(scaled)
+    if valid is not None:
+        invalid |= ~valid
+    np.clip(scaled, 0, levels - 1, out=scaled)
+    scaled[invalid] = levels
+
+    if out is None:
+        out = np.empty(index.shape, dtype=code_dtype(levels))
+    np.copyto(out, scaled, casting="unsafe")  # Truncates, so each code covers [edge, next edge)
+    return out
+
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def colormap_lut(name, levels=INDEX_LEVELS, low=None, high=None):
+    """
+    Packed RGBA lookup table for ``levels`` index codes, plus a transparent
+    entry at the end for the invalid code.
+
+    Codes below ``low`` or above ``high`` take the colormap's end colours,
+    the way the spectrum range tool clips the index.
+    """
+    centers = -1 + (np.arange(levels) + 0.5) * (2 / levels)
+    rgba = colormaps[name]((centers + 1) / 2, bytes=True)  # (levels, 4) uint8
+    if low is not None:
+        rgba[centers < low] = rgba[0]
+    if high is not None:
+        rgba[centers > high] = rgba[-1]
+    rgba[:, 3] = 255
+
+    lut = np.zeros(levels + 1, dtype=np.uint32)
+    lut[:levels] = rgba.view(np.uint32).ravel()
+    lut.flags.writeable = False  # Shared by every caller
+    return lut
+
+
+def render_codes(codes, colormap, low=None, high=None, levels=INDEX_LEVELS, out=None):
+    """Packed uint32 image for ``codes``, one gather through the colormap's lookup table."""
+    # "clip" skips the bounds check and the temporary copy np.take makes for out= otherwise
+    return np.take(colormap_lut(colormap, levels, low, high), codes, out=out, mode="clip")
+
+
+# Index views can also be colored in the browser: the codes go out once as a
+# uint8 image and a LinearColorMapper applies one of these palettes, so a new
+# colormap or clip range is a palette update of a few KB, not a new image.
+
+PALETTE_LEVELS = 255  # Codes sent to the browser, leaving 255 for transparent
+PALETTE_LOW = -0.5  # LinearColorMapper range putting code k on palette entry k
+PALETTE_HIGH = PALETTE_LEVELS + 0.5
+
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def colormap_palette(name, low=None, high=None):
+    """
+    Bokeh palette of ``colormap_lut(name, PALETTE_LEVELS, low, high)``, the
+    last entry transparent, for a LinearColorMapper from ``PALETTE_LOW`` to
+    ``PALETTE_HIGH``.
+    """
+    rgba = colormap_lut(name, PALETTE_LEVELS, low, high).view(np.uint8).reshape(-1, 4)
+    return tuple(f"#{r:02x}{g:02x}{b:02x}{a:02x}" for r, g, b, a in rgba.tolist())
+
+
+# Histograms come from the codes too: one bincount per block while the
+# index is quantized, then any number of display bins from those counts.
+
+HISTOGRAM_BINS = 125
+
+
+def code_counts(codes, levels=INDEX_LEVELS, step=1):
+    """
+    Pixels per code, the transparent code left out.
+
+    With ``step`` above 1 only every ``step``-th row and column is counted,
+    scaled up to an estimate for the whole array.
+    """
+    sample = codes[::step, ::step] if step > 1 else codes
+    counts = np.bincount(sample.ravel(), minlength=levels + 1)[:levels]
+    return counts * (step * step)
+
+
+def rebin_counts(counts, bins=HISTOGRAM_BINS):
+    """
+    ``(hist, edges)`` over [-1, 1] like np.histogram, from per-code counts
+    without another pass over the pixels.
+
+    Each code's count is spread evenly across its bin, so bin counts that
+    don't divide the number of codes don't alias into a sawtooth.
+    """
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    edges = np.linspace(-1, 1, bins + 1)
+    hist = np.diff(np.interp(edges, np.linspace(-1, 1, len(counts) + 1), cumulative))
+    return hist, edges
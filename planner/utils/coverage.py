@@ -0,0 +1,91 @@
+import numpy as np
+
+# Area coverage ("lawnmower") surveys: parallel passes over a polygon,
+# flown back and forth, with waypoints spaced evenly along each pass.
+
+AUTO_LINES = 25  # Passes across the polygon when no line spacing is given
+
+
+def lawnmower(xs, ys, spacing=None, heading=0.0, overlap=0.0, turn_margin=0.0):
+    """
+    Boustrophedon waypoints covering the polygon with vertices ``xs``, ``ys``.
+
+    Parameters:
+        spacing: float
+            Sensor footprint width in map units. Passes are ``spacing *
+            (1 - overlap)`` apart and so are waypoints along a pass. Defaults
+            to a width giving ``AUTO_LINES`` passes.
+        heading: float
+            Direction of the passes in degrees clockwise from north (map up).
+        overlap: float
+            Side overlap between neighbouring passes, from 0 to just under 1.
+        turn_margin: float
+            Map units each pass runs past the polygon edge, so turns happen
+            outside the area being covered.
+
+    Returns:
+        (x, y) arrays of waypoints in flight order. Concave polygons give
+        several segments per pass, flown in order along the pass.
+    """
+    vertices = np.column_stack([xs, ys]).astype(float)
+    if len(vertices) < 3 or polygon_area(vertices) == 0:
+        return np.empty(0), np.empty(0)
+
+    # Along-pass and across-pass unit vectors
+    theta = np.radians(heading)
+    along = np.array([np.sin(theta), np.cos(theta)])
+    across = np.array([np.cos(theta), -np.sin(theta)])
+    u = vertices @ along
+    v = vertices @ across
+
+    if spacing is None or spacing <= 0:
+        spacing = (v.max() - v.min()) / AUTO_LINES
+    step = spacing * (1 - min(max(overlap, 0.0), 0.95))
+    if not step > 0:
+        return np.empty(0), np.empty(0)
+
+    # Pass positions across the polygon, half a step in from the edges
+    lines = np.arange(v.min() + step / 2, v.max(), step)
+
+    # Every pass against every edge. Half-open test so a vertex on a pass counts once.
+    u1, v1 = u, v
+    u2, v2 = np.roll(u, -1), np.roll(v, -1)
+    level = lines[:, None]
+    crosses = (v1 <= level) != (v2 <= level)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hits = np.where(crosses, u1 + (level - v1) * (u2 - u1) / (v2 - v1), np.nan)
+    hits.sort(axis=1)  # NaNs sort last
+
+    # Consecutive crossings pair up into inside segments
+    num_hits = np.sum(~np.isnan(hits), axis=1)
+    pairs = hits[:, : hits.shape[1] // 2 * 2].reshape(len(lines), -1, 2)
+    line_index, pair_index = np.nonzero(np.arange(pairs.shape[1]) < (num_hits // 2)[:, None])
+    start = pairs[line_index, pair_index, 0] - turn_margin
+    end = pairs[line_index, pair_index, 1] + turn_margin
+    level = lines[line_index]
+
+    # Fly odd passes the other way, including the order of their segments
+    backwards = line_index % 2 == 1
+    order = np.lexsort((np.where(backwards, -start, start), line_index))
+    start, end, level, backwards = start[order], end[order], level[order], backwards[order]
+
+    # Evenly spaced waypoints along each segment, both ends included
+    counts = np.maximum(np.ceil((end - start) / step).astype(int), 1) + 1
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    index = np.arange(counts.sum()) - offsets
+    seg_counts = np.repeat(counts, counts)
+    index = np.where(np.repeat(backwards, counts), seg_counts - 1 - index, index)
+    fraction = index / (seg_counts - 1)
+
+    seg_start = np.repeat(start, counts)
+    pos_u = seg_start + fraction * (np.repeat(end, counts) - seg_start)
+    pos_v = np.repeat(level, counts)
+
+    points = pos_u[:, None] * along + pos_v[:, None] * across
+    return points[:, 0], points[:, 1]
+
+
+def polygon_area(vertices):
+    """Unsigned shoelace area of an (n, 2) vertex array."""
+    x, y = vertices[:, 0], vertices[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
@@ -0,0 +1,112 @@
+import logging
+import os
+import shutil
+import time
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+import config
+
+# Uploads and tile pyramids stay on disk so any server process can reuse
+# them, which means the directories grow with every new image. A periodic
+# sweep deletes entries nobody has used for a while, then the least recently
+# used ones while a directory is over its size budget. "Used" is the newest
+# access or modification time in an entry: uploads are marked whenever a
+# session asks for them, pyramids and their images whenever a process opens
+# the pyramid or serves its tiles.
+
+CLEANUP_INTERVAL_MS = 15 * 60 * 1000  # How often the directories are swept
+IN_USE_SECONDS = 600  # Entries used this recently are never deleted, whatever the budget
+
+logger = logging.getLogger("waypoint_planner")
+
+_cleanup = None
+
+
+def mark_used(path):
+    """
+    Set a file's access time to now, keeping it past the next sweep. The
+    modification time stays, since file digests are remembered by it.
+    """
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def prune_directory(directory, max_age, max_bytes):
+    """
+    Delete entries (files or whole subdirectories) of ``directory`` unused for
+    more than ``max_age`` seconds, then the least recently used ones until the
+    rest fit in ``max_bytes``. Returns the names deleted.
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = [(*_usage(entry), entry) for entry in it]
+    except FileNotFoundError:
+        return []
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for used, size, entry in sorted(entries, key=lambda item: item[0]):
+        age = now - used
+        if age <= IN_USE_SECONDS or (age <= max_age and total <= max_bytes):
+            break  # Everything after this is more recently used
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Another server process got there first
+        total -= size
+        removed.append(entry.name)
+    return removed
+
+
+def _usage(entry):
+    """(last used, bytes) of a file, or of everything under a directory."""
+    try:
+        info = entry.stat(follow_symlinks=False)
+    except FileNotFoundError:
+        return 0, 0
+    if not entry.is_dir(follow_symlinks=False):
+        return max(info.st_atime, info.st_mtime), info.st_size
+
+    used, size = info.st_mtime, 0
+    for root, dirs, files in os.walk(entry.path):
+        for name in dirs:
+            used = max(used, _lstat(os.path.join(root, name)).st_mtime)
+        for name in files:
+            info = _lstat(os.path.join(root, name))
+            used = max(used, info.st_atime, info.st_mtime)
+            size += info.st_size
+    return used, size
+
+
+def _lstat(path):
+    try:
+        return os.lstat(path)
+    except FileNotFoundError:
+        return os.stat_result((0,) * 10)  # Deleted meanwhile, counts for nothing
+
+
+def clean_directories():
+    """One sweep of the upload and tile directories."""
+    uploads = prune_directory(config.UPLOAD_DIR, config.UPLOAD_MAX_AGE_SECONDS, config.UPLOAD_DIR_MAX_BYTES)
+    pyramids = prune_directory(config.TILE_CACHE_DIR, config.TILE_MAX_AGE_SECONDS, config.TILE_DIR_MAX_BYTES)
+    if uploads or pyramids:
+        logger.info(f"Deleted {len(uploads)} unused uploads and {len(pyramids)} unused tile pyramids")
+
+
+def start_cleanup():
+    """Sweep now and then every CLEANUP_INTERVAL_MS, off the IO loop. Call once per server process."""
+    global _cleanup
+    if _cleanup is None:
+        sweep = lambda: IOLoop.current().run_in_executor(None, clean_directories)
+        _cleanup = PeriodicCallback(sweep, CLEANUP_INTERVAL_MS)
+        _cleanup.start()
+        sweep()
+    return _cleanup
@@ -0,0 +1,62 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+
+# Pools for CPU-heavy work, so it never runs on the Tornado IO loop that
+# every session on this server process shares.
+
+_decode_executor = None
+_plan_executor = None
+_index_executor = None
+
+
+def decode_executor():
+    """
+    Pool for raster decoding, created on first use.
+
+    ``PLANNER_DECODE_EXECUTOR=process`` gives real parallelism but jobs then
+    run in another process: they must be picklable, and what they cache only
+    reaches the server through the shared store (``PLANNER_SHARED_STORE_BYTES``).
+    Threads share the caches directly and are the default, since GDAL and
+    NumPy release the GIL for the heavy parts anyway.
+    """
+    global _decode_executor
+    if _decode_executor is None:
+        if config.DECODE_EXECUTOR == "process":
+            # Spawn, since forking a process with a running IO loop and GDAL threads is asking for trouble
+            _decode_executor = ProcessPoolExecutor(
+                max_workers=config.DECODE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _decode_executor = ThreadPoolExecutor(max_workers=config.DECODE_WORKERS, thread_name_prefix="decode")
+    return _decode_executor
+
+
+def plan_executor():
+    """
+    Threads for route planning, created on first use.
+
+    The local search is plain Python and holds the GIL, but the interpreter
+    still hands the IO loop a turn every few milliseconds, and threads let
+    a session watch progress and cancel a plan without any pickling.
+    """
+    global _plan_executor
+    if _plan_executor is None:
+        _plan_executor = ThreadPoolExecutor(max_workers=config.PLAN_WORKERS, thread_name_prefix="plan")
+    return _plan_executor
+
+
+def index_executor():
+    """
+    Threads for vegetation index math, created on first use.
+
+    Index layers are split into row blocks across these. NumPy releases the
+    GIL in the ufuncs, so blocks really do run in parallel, one per core by
+    default.
+    """
+    global _index_executor
+    if _index_executor is None:
+        _index_executor = ThreadPoolExecutor(max_workers=config.INDEX_WORKERS, thread_name_prefix="index")
+    return _index_executor
@@ -1,123 +1,312 @@
 import numpy as np
+import rasterio
 from rasterio.io import MemoryFile
 from rasterio.enums import Resampling
-from matplotlib import cm
+from rasterio.windows import Window
 import os
 import base64
-from scipy.spatial.distance import cdist
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import partial
+import config
+from utils.cache import INDEX_CACHE, RASTER_CACHE, bytes_digest, file_digest
+from utils.executor import index_executor
+from utils.metrics import GEOTIFF_SECONDS, PLAN_POINTS, PLAN_SECONDS, STAGE_SECONDS
+from utils.colormaps import HISTOGRAM_BINS, INDEX_LEVELS, code_counts, code_dtype, quantize_index, render_codes
+from utils.routing import improve_tour, initial_tour, path_length
 from scipy.optimize import linear_sum_assignment
 
-def process_geotiff(file_contents, logger, downsample_factor=1):
-    """Load and preprocess GeoTIFF."""
-    # global r_norm, g_norm, b_norm, non_transparent_mask, rgba_image, alpha, bounds
+OPEN_RASTERS_PER_THREAD = 8  # Datasets each thread keeps open between reads
+STATS_BLOCK_SAMPLES = 1024  # Pixels per block kept for percentile stretch
+STRIP_BYTES = 16 * 1024 * 1024  # Float working set while stretching a non-uint8 read
+INDEX_BLOCK_ROWS = 256  # Rows of vegetation index math at a time
+
+_open_rasters = threading.local()
+
+
+def open_raster(path):
+    """
+    Long-lived rasterio dataset for a GeoTIFF on disk. Do not close it.
+
+    GDAL drops a dataset's cached blocks when it is closed, so keeping handles
+    open lets repeat reads (tiles, pans, new sessions) come out of the block
+    cache instead of off disk. Handles are per thread since rasterio datasets
+    are not thread-safe, and are reopened if the file changes.
+    """
+    datasets = getattr(_open_rasters, "datasets", None)
+    if datasets is None:
+        datasets = _open_rasters.datasets = OrderedDict()
+
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    src = datasets.get(key)
+    if src is not None and not src.closed:
+        datasets.move_to_end(key)
+        return src
+
+    src = datasets[key] = rasterio.open(path)
+    while len(datasets) > OPEN_RASTERS_PER_THREAD:
+        _, evicted = datasets.popitem(last=False)
+        evicted.close()
+    return src
+
 
-    decoded = None  # To hold the decoded or raw data
+def read_file_contents(file_contents, logger):
+    """
+    Raw GeoTIFF bytes from a (possibly headed) Base64 upload. Local paths
+    don't come through here, they are opened in place with ``open_raster``.
+    """
+    decoded = None  # To hold the decoded data
     # file_contents = fix_base64_padding(file_contents) # Fix padding before decoding
 
-    # Handle local file or uploaded file
-    if os.path.isfile(file_contents):
-        logger.debug("Loaded GeoTIFF from local file.")
-        with open(file_contents, "rb") as f:
-            decoded = f.read()
+    with STAGE_SECONDS.time(stage="decode"):
+        if "," in file_contents:
+            logger.debug("Uploaded file with Base64 header.")
+            _, encoded = file_contents.split(",", 1)
+            decoded = base64.b64decode(encoded)
+
+        else:
+            logger.debug("Uploaded file without Base64 header.")
+            decoded = base64.b64decode(file_contents)
+
+    return decoded
+
+
+def process_geotiff(file_contents, logger, downsample_factor=1):
+    """
+    Load and preprocess GeoTIFF. Results are shared through the process-wide raster cache.
 
-    elif "," in file_contents:
-        logger.debug("Uploaded file with Base64 header.")
-        _, encoded = file_contents.split(",", 1)
-        decoded = base64.b64decode(encoded)
+    Local paths are opened in place; only Base64 uploads are decoded into memory.
+    """
+    # global r_norm, g_norm, b_norm, non_transparent_mask, rgba_image, alpha, bounds
 
+    start = time.perf_counter()
+    decoded = None
+    if os.path.isfile(file_contents):
+        digest = file_digest(file_contents)
     else:
-        logger.debug("Uploaded file without Base64 header.")
-        decoded = base64.b64decode(file_contents)
+        decoded = read_file_contents(file_contents, logger)
+        digest = bytes_digest(decoded)
+
+    cache_key = (digest, downsample_factor)
+    cached = RASTER_CACHE.get(cache_key)
+    if cached is not None:
+        logger.debug(f"Raster cache hit for {digest}")
+        GEOTIFF_SECONDS.observe(time.perf_counter() - start, cache="hit")
+        return cached
 
     # Now we have the image data in the correct format.
     # Let's open and process it here
     try:
-        with MemoryFile(decoded) as memfile:
-            with memfile.open() as src:
-                logger.debug(f"Band Data Type: {src.dtypes[0]}")  # e.g., 'uint8', 'uint16', 'float32'
-                logger.debug(f"Value Range: Min={src.read(1).min()}, Max={src.read(1).max()}")
-                logger.debug(f"The image has {src.count} bands.")
-                
-                image = extract_image_data(src, downsample_factor)
-                bounds = src.bounds # Geographic bounds in WGS84
+        with ExitStack() as stack:
+            if decoded is None:
+                src = open_raster(file_contents)  # Straight off disk, GDAL reads only the blocks it needs
+            else:
+                memfile = stack.enter_context(MemoryFile(decoded))
+                src = stack.enter_context(memfile.open())
+
+            logger.debug(f"Band Data Type: {src.dtypes[0]}")  # e.g., 'uint8', 'uint16', 'float32'
+            logger.debug(f"The image has {src.count} bands.")
+
+            ranges = None
+            if src.dtypes[0] != "uint8":
+                ranges = band_ranges(src, [1, 2, 3, 4] if src.count == 4 else [1, 2, 3], digest)
+                logger.debug(f"Band ranges: {ranges.tolist()}")
+            image = extract_image_data(src, downsample_factor, ranges=ranges)
+            bounds = src.bounds # Geographic bounds in WGS84
     except Exception as e:
         logger.error(f"Error during file processing: {e}", exc_info=True)
+        raise  # Callers need rasterio's error, not a missing image further down
 
     logger.debug("Success processing image")
-    return image, bounds
+    GEOTIFF_SECONDS.observe(time.perf_counter() - start, cache="miss")
+    return RASTER_CACHE.put(cache_key, (image, bounds))
 
 
-def extract_image_data(src, downsample_factor=1):
+def extract_image_data(src, downsample_factor=1, window=None, out_size=None, ranges=None):
     """
     Extract RGBA image and bounds from GeoTIFF with optional downsampling.
+
+    Pass a ``window`` to read only part of the raster, and ``out_size``
+    (height, width) to resample it to an exact size instead of a fixed ratio.
+    Non-uint8 rasters are stretched with ``ranges`` (see ``band_ranges``),
+    measured here if not given.
     """
     num_bands = src.count
-    height = src.height // downsample_factor
-    width = src.width // downsample_factor
+    if out_size is not None:
+        height, width = out_size
+    elif window is not None:
+        height = int(window.height) // downsample_factor
+        width = int(window.width) // downsample_factor
+    else:
+        height = src.height // downsample_factor
+        width = src.width // downsample_factor
     # bounds = src.bounds # Geographic bounds in WGS84
 
+    rgba_image = np.empty((height, width), dtype=np.uint32)  # Bokeh image format
+    pack_rgba(src, rgba_image, window, ranges)
+    return rgba_image
+
+
+def pack_rgba(src, rgba_image, window=None, ranges=None):
+    """
+    Read ``src`` (resampled to the buffer's shape) into a preallocated
+    (height, width) uint32 ``rgba_image``, bottom row first as Bokeh wants.
+
+    uint8 bands are read by GDAL straight into the buffer through a flipped,
+    band-interleaved view, and a synthetic alpha is filled in place, so
+    there is no copy besides the output itself. Anything else is stretched
+    strip by strip (see ``_pack_stretched``).
+    """
+    height, width = rgba_image.shape
+    channels = rgba_image.view(np.uint8).reshape(height, width, 4)[::-1].transpose(2, 0, 1)  # (4, h, w), top-down
+    num_bands = src.count
+
     # Expecting [0,255] RGBA image (4 bands)
     if src.dtypes[0] == 'uint8' and num_bands == 4:
-        bands = src.read(
-            [1, 2, 3, 4],
-            out_shape=(num_bands, height, width),
-            resampling=Resampling.bilinear
-        ).astype(np.uint8)  # R, G, B, A (shape: 4 x height x width)
-
-        image = np.ascontiguousarray(np.transpose(bands, (1, 2, 0))) # Put first dim to end
-        rgba_image = np.flipud(image.view(dtype=np.uint32).reshape(image.shape[:2])) # Bokeh image format
-  
-        return rgba_image
+        with STAGE_SECONDS.time(stage="read"):
+            src.read([1, 2, 3, 4], out=channels, window=window, resampling=Resampling.bilinear)
 
     # [0,255], but only 3 bands this time
     elif src.dtypes[0] == 'uint8' and num_bands == 3:
-        r,g,b = src.read(
-            [1, 2, 3],
-            out_shape=(num_bands, height, width),
-            resampling=Resampling.bilinear
-        ).astype(np.uint8)  # R, G, B
-
-        alpha = np.where((r == 0) & (g == 0) & (b == 0), 0, 255).astype(np.uint8)  # Fully opaque except where RGB is all 0
-        image = np.dstack((r, g, b, alpha)) # Add in our artifical alpha channel
-        rgba_image = np.flipud(image.view(dtype=np.uint32).reshape(image.shape[:2])) # Bokeh image format
-  
-        return rgba_image
+        with STAGE_SECONDS.time(stage="read"):
+            src.read([1, 2, 3], out=channels[:3], window=window, resampling=Resampling.bilinear)
+
+        # Fully opaque except where RGB is all 0
+        with STAGE_SECONDS.time(stage="pack"):
+            alpha = channels[3]
+            np.bitwise_or(channels[0], channels[1], out=alpha)
+            np.bitwise_or(alpha, channels[2], out=alpha)
+            np.minimum(alpha, 1, out=alpha)
+            alpha *= 255
 
     else:
-        r,g,b = src.read(
-            [1, 2, 3],
-            out_shape=(num_bands, height, width),
-            resampling=Resampling.bilinear
-        ).astype(np.float32)  # R, G, B
-        
-        r_norm = (r - np.min(r)) / (np.max(r) - np.min(r))
-        g_norm = (g - np.min(g)) / (np.max(g) - np.min(g))
-        b_norm = (b - np.min(b)) / (np.max(b) - np.min(b))
-
-        if num_bands == 4:
-            a = src.read(
-                4,
-                out_shape=(num_bands, height, width),
-                resampling=Resampling.bilinear
-            ).astype(np.float32) # Read the alpha channel if it exists
-            alpha = (a - np.min(a)) / (np.max(a) - np.min(a))
-        else:
-            alpha = np.where((r == 0) & (g == 0) & (b == 0), 0, 1).astype(float) # Create alpha channel
+        # Anything else (16-bit, float...) is stretched to [0,255] with raster-wide ranges
+        indexes = [1, 2, 3, 4] if num_bands == 4 else [1, 2, 3]
+        if ranges is None:
+            ranges = band_ranges(src, indexes)
+        _pack_stretched(src, indexes, ranges, window, channels)
+
+    return rgba_image
+
+
+def band_ranges(src, indexes, digest=None):
+    """
+    Per-band (low, high) display range as a (bands, 2) array.
+
+    Walks the raster block by block, so memory stays at one block whatever the
+    image size. At most ``config.STATS_MAX_BLOCKS`` evenly spaced blocks are
+    read; with ``config.STRETCH_PERCENT`` the ranges are percentiles of a
+    subsample of each block instead of plain min/max. Pass the content
+    ``digest`` to share the result through the raster cache.
+    """
+    if digest is not None:
+        key = ("ranges", digest, tuple(indexes), config.STRETCH_PERCENT, config.STATS_MAX_BLOCKS)
+        return RASTER_CACHE.get_or_create(key, partial(band_ranges, src, indexes))
+    with STAGE_SECONDS.time(stage="ranges"):
+        return _band_ranges(src, indexes)
+
+
+def _band_ranges(src, indexes):
+    """The block walk behind ``band_ranges``."""
+
+    windows = [window for _, window in src.block_windows(1)]
+    if 0 < config.STATS_MAX_BLOCKS < len(windows):
+        picks = np.linspace(0, len(windows) - 1, config.STATS_MAX_BLOCKS).round().astype(int)
+        windows = [windows[i] for i in np.unique(picks)]
 
-        image = np.dstack((r_norm, g_norm, b_norm, alpha))
-        rgba_image = np.flipud((image * 255).astype(np.uint8).view(dtype=np.uint32).reshape(image.shape[:2])) 
+    low = np.full(len(indexes), np.inf)
+    high = np.full(len(indexes), -np.inf)
+    samples = []
+    for window in windows:
+        block = src.read(indexes, window=window).reshape(len(indexes), -1)
+        if not np.issubdtype(block.dtype, np.integer):
+            block = np.where(np.isfinite(block), block, np.nan)
+            if np.isnan(block).all():
+                continue
+        np.fmin(low, np.nanmin(block, axis=1), out=low)
+        np.fmax(high, np.nanmax(block, axis=1), out=high)
+        if config.STRETCH_PERCENT > 0:
+            step = max(1, block.shape[1] // STATS_BLOCK_SAMPLES)
+            samples.append(block[:, ::step].astype(np.float64))
 
-        return rgba_image
+    ranges = np.stack([low, high], axis=1)
+    ranges[~np.isfinite(ranges)] = 0.0  # All nodata, everything maps to 0
+    if samples:
+        pct = config.STRETCH_PERCENT
+        ranges = np.nanpercentile(np.concatenate(samples, axis=1), [pct, 100 - pct], axis=1).T
+    return ranges
 
 
-def plan_traversal(marker_source):
+def _pack_stretched(src, indexes, ranges, window, channels):
+    """
+    Read, stretch and pack bands into ``channels`` one strip of output rows
+    at a time, so the float working set is a strip, not the whole image. The
+    strip buffer is reused, so there is one float allocation per call.
+    """
+    _, height, width = channels.shape
+    if window is None:
+        window = Window(0, 0, src.width, src.height)
+    rows_per_strip = min(height, max(1, STRIP_BYTES // (width * len(indexes) * 4)))
+    src_rows_per_row = window.height / height
+
+    strip_buffer = np.empty((len(indexes), rows_per_strip, width), dtype=np.float32)
+    scales = [255.0 / (high - low) if high > low else 0.0 for low, high in ranges]
+    read_seconds = 0.0
+    start = time.perf_counter()
+    for row in range(0, height, rows_per_strip):
+        rows = min(rows_per_strip, height - row)
+        strip_window = Window(
+            window.col_off, window.row_off + row * src_rows_per_row,
+            window.width, rows * src_rows_per_row,
+        )
+        read_start = time.perf_counter()
+        strip = src.read(
+            indexes,
+            out=strip_buffer[:, :rows],
+            window=strip_window,
+            resampling=Resampling.bilinear,
+        )
+        read_seconds += time.perf_counter() - read_start
+        dest = channels[:, row:row + rows]
+
+        if len(indexes) == 3:
+            # Fully opaque except where RGB is all 0
+            alpha = dest[3]
+            alpha[...] = 0
+            for band in strip:
+                alpha[band != 0] = 255
+
+        for i, ((low, _), scale) in enumerate(zip(ranges, scales)):
+            band = strip[i]
+            band -= low
+            band *= scale
+            np.clip(band, 0, 255, out=band)
+            np.nan_to_num(band, copy=False)
+            dest[i] = band
+
+    # Reads and stretching interleave strip by strip, so each stage is one total per call
+    STAGE_SECONDS.observe(read_seconds, stage="read")
+    STAGE_SECONDS.observe(time.perf_counter() - start - read_seconds, stage="pack")
+
+
+def plan_traversal(marker_source, time_budget=None, logger=None):
     """
     Plan the shortest traversal path for the given markers.
-    Uses a heuristic for the Traveling Salesman Problem (TSP).
+    Uses a heuristic for the Traveling Salesman Problem (TSP): a greedy
+    nearest-neighbour path (or a space-filling curve for large plans), then
+    2-opt / Or-opt local search. No n x n distance matrix is built for large plans.
 
     Parameters:
         marker_source: ColumnDataSource
             The source containing x, y, and label of points.
+        time_budget: float
+            Seconds the local search may run, defaults to config.TSP_TIME_BUDGET_MS.
+        logger:
+            If given, the greedy and improved path lengths are logged.
 
     Returns:
         List of indices representing the traversal order.
@@ -131,45 +320,117 @@ def plan_traversal(marker_source):
         return list(range(len(x_coords)))  # No need for traversal if < 2 points
 
     # Combine x and y into coordinates
-    points = np.array(list(zip(x_coords, y_coords)))
-
-    # Compute pairwise distances
-    distance_matrix = cdist(points, points, metric="euclidean")
-
-    # Use a heuristic method to solve TSP (nearest neighbor)
-    num_points = len(points)
-    unvisited = set(range(num_points))
-    path = []
-    current = 0  # Start at the first point
-    path.append(current)
-    unvisited.remove(current)
-
-    while unvisited:
-        # Find the nearest neighbor
-        nearest = min(unvisited, key=lambda point: distance_matrix[current, point])
-        path.append(nearest)
-        unvisited.remove(nearest)
-        current = nearest
+    points = np.column_stack([x_coords, y_coords]).astype(float)
 
+    if time_budget is None:
+        time_budget = config.TSP_TIME_BUDGET_MS / 1000
+    with PLAN_SECONDS.time():
+        seed = initial_tour(points)
+        path = improve_tour(points, seed, time_budget)
+    PLAN_POINTS.observe(len(points))
+
+    if logger is not None:
+        before, after = path_length(points, seed), path_length(points, path)
+        saved = 100 * (1 - after / before) if before else 0.0
+        logger.info(f"Traversal of {len(path)} points: initial {before:.6g}, improved {after:.6g} ({saved:.1f}% shorter)")
     return path
 
+VEGETATION_INDEXES = ("VARI", "GNDVI")
+
+
 def calculate_index(index_name, bands, alpha, colormap="RdYlGn"):
-    """Calculate vegetation index and return a normalized RGBA image."""
+    """Vegetation index as a packed uint32 image ready for Bokeh, or None for an unknown index."""
+    codes = index_codes(index_name, bands, alpha)
+    if codes is None:
+        return None
+    return render_codes(codes, colormap)
+
+
+def vegetation_index(index_name, bands, dtype=np.float32):
+    """
+    Float index from normalized ``bands`` (r, g, b), or None for an unknown
+    index. Computed in place in two ``dtype`` arrays, with no other
+    temporaries.
+    """
     r_norm, g_norm, b_norm = bands
     if index_name == "VARI":
-        index = (g_norm - r_norm) / (g_norm + r_norm - b_norm + 1e-6)
+        numerator = np.subtract(g_norm, r_norm, dtype=dtype)
+        denominator = np.add(g_norm, r_norm, dtype=dtype)
+        np.subtract(denominator, b_norm, out=denominator, dtype=dtype)
     elif index_name == "GNDVI":
-        index = (g_norm - b_norm) / (g_norm + b_norm + 1e-6)
+        numerator = np.subtract(g_norm, b_norm, dtype=dtype)
+        denominator = np.add(g_norm, b_norm, dtype=dtype)
     else:
         return None
-    index = np.clip(index, -1, 1)
-    index_norm = (index + 1) / 2
-    colored_index = cm.get_cmap(colormap)(index_norm)
-    colored_index[..., -1] = alpha
-    return colored_index
+    denominator += 1e-6
+    return np.divide(numerator, denominator, out=numerator)
+
+
+def index_codes(index_name, bands, alpha, levels=INDEX_LEVELS):
+    """
+    Quantized vegetation index (see utils.colormaps), transparent where
+    ``alpha`` is 0. Rows are flipped for Bokeh already, so rendering is a
+    straight gather.
+    """
+    if index_name not in VEGETATION_INDEXES:
+        return None
+    return _index_blocks(index_name, bands, alpha, levels)[0]
+
+
+def index_layer(image_id, index_name, bands, alpha, levels=INDEX_LEVELS):
+    """
+    Quantized index and its pixel count per code as ``(codes, counts)``, or
+    None for an unknown index. ``colormaps.rebin_counts(counts, bins)``
+    gives the histogram for any number of bins.
+
+    Layers are cached in INDEX_CACHE per image, index and resolution, so
+    changing the colormap or clip range, or switching back to an index
+    already seen, only re-renders the codes. ``image_id`` must change
+    whenever the pixels do, a content digest is ideal.
+    """
+    if index_name not in VEGETATION_INDEXES:
+        return None
+    key = (image_id, index_name, np.shape(alpha), levels)
+    return INDEX_CACHE.get_or_create(key, lambda: _index_blocks(index_name, bands, alpha, levels))
+
+
+def _index_blocks(index_name, bands, alpha, levels):
+    """
+    Quantize the index in blocks of rows spread over the index executor.
+
+    Each block does its math in float32 temporaries the size of the block,
+    writes its codes straight into its own rows of the result and counts
+    them while they are still in cache. Blocks never overlap, so there are
+    no locks, and NumPy releases the GIL for the heavy parts. Must not be
+    called from the index executor itself.
+    """
+    alpha = np.asarray(alpha)
+    codes = np.empty(alpha.shape, dtype=code_dtype(levels))
+    flipped = codes[::-1]  # Row order for Bokeh
+    step = _histogram_step(alpha.size)
+
+    def quantize_block(start):
+        rows = slice(start, start + INDEX_BLOCK_ROWS)
+        index = vegetation_index(index_name, [band[rows] for band in bands])
+        block = quantize_index(index, alpha[rows] > 0, levels, out=flipped[rows], overwrite=True)
+        # Sample every step-th row of the whole image, not of each block
+        return code_counts(block[-start % step:], levels, step)
+
+    starts = range(0, alpha.shape[0], INDEX_BLOCK_ROWS)
+    counts = sum(index_executor().map(quantize_block, starts), np.zeros(levels, dtype=np.int64))
+    return codes, counts
+
+
+def _histogram_step(num_pixels):
+    """Row and column stride for the index histogram, above 1 only past config.HISTOGRAM_MAX_PIXELS."""
+    limit = config.HISTOGRAM_MAX_PIXELS
+    if limit <= 0 or num_pixels <= limit:
+        return 1
+    return math.ceil(math.sqrt(num_pixels / limit))
 
 
-def compute_histogram(index_data):
-    """Compute histogram of vegetation index."""
-    hist, edges = np.histogram(index_data, bins=125, range=(-1, 1))
-    return hist, edges
+def compute_histogram(index_data, bins=HISTOGRAM_BINS):
+    """Compute histogram of vegetation index over [-1, 1]. NaNs and values outside are left out."""
+    index_data = np.asarray(index_data)
+    codes = quantize_index(index_data, (index_data >= -1) & (index_data <= 1), levels=bins)
+    return code_counts(codes, bins), np.linspace(-1, 1, bins + 1)
@@ -0,0 +1,182 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import numpy as np
+from bokeh.document.events import ColumnDataChangedEvent, ColumnsPatchedEvent, ColumnsStreamedEvent, ModelChangedEvent
+from bokeh.models import ColumnDataSource
+from tornado.web import RequestHandler
+
+# Counters and histograms for the hot paths, served as Prometheus text on
+# /metrics. Everything is in memory and per process: with --num-procs each
+# worker reports its own numbers, and work done in a process decode pool is
+# not counted. Recording is a lock and a few additions, cheap enough to
+# leave on everywhere.
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BYTES_BUCKETS = tuple(1024 * 4**i for i in range(10))  # 1 KB to 256 MB
+POINTS_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000)
+
+_metrics = []  # Everything registered, in the order it is rendered
+
+
+class _Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class Histogram(_Metric):
+    """Cumulative buckets, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the ``with`` block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", self._labels(key, le=le), cumulative
+            yield f"{self.name}_sum", self._labels(key), total
+            yield f"{self.name}_count", self._labels(key), count
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The planner's metrics
+# ==================================================
+STAGE_SECONDS = Histogram(
+    "planner_stage_seconds",
+    "Time in each stage of turning a GeoTIFF into a Bokeh image: decode, ranges, read (incl. resampling), pack.",
+    ["stage"],
+)
+GEOTIFF_SECONDS = Histogram(
+    "planner_process_geotiff_seconds", "process_geotiff calls, by raster cache result.", ["cache"]
+)
+UPLOAD_SECONDS = Histogram(
+    "planner_upload_seconds", "From an upload being queued to its first view being ready, by outcome.", ["outcome"]
+)
+PLAN_SECONDS = Histogram("planner_plan_seconds", "Route planning runs, initial route plus local search.")
+PLAN_POINTS = Histogram("planner_plan_points", "Waypoints per route planning run.", buckets=POINTS_BUCKETS)
+SESSION_CREATE_SECONDS = Histogram("planner_session_create_seconds", "Building a new session's layout.")
+SESSIONS_CREATED = Counter("planner_sessions_created_total", "Sessions created.")
+SESSIONS_DESTROYED = Counter("planner_sessions_destroyed_total", "Sessions closed and torn down.")
+SOURCE_UPDATE_BYTES = Histogram(
+    "planner_source_update_bytes",
+    "Approximate bytes each ColumnDataSource change pushes to the browser, by kind (data, patch, stream).",
+    ["kind"],
+    buckets=BYTES_BUCKETS,
+)
+
+
+def watch_source_updates(document):
+    """Record the size of every ColumnDataSource change made to ``document``."""
+    document.on_change(_record_source_update)
+
+
+def _record_source_update(event):
+    if event.setter is not None:
+        return  # Came from the browser, nothing is sent back
+    if isinstance(event, ModelChangedEvent):
+        if isinstance(event.model, ColumnDataSource) and event.attr == "data":
+            SOURCE_UPDATE_BYTES.observe(_payload_bytes(event.new), kind="data")
+    elif isinstance(event, ColumnDataChangedEvent):
+        data = event.data if event.data is not None else event.model.data
+        columns = event.cols if event.cols is not None else data.keys()
+        SOURCE_UPDATE_BYTES.observe(sum(_payload_bytes(data[name]) for name in columns), kind="data")
+    elif isinstance(event, ColumnsPatchedEvent):
+        SOURCE_UPDATE_BYTES.observe(_payload_bytes(event.patches), kind="patch")
+    elif isinstance(event, ColumnsStreamedEvent):
+        SOURCE_UPDATE_BYTES.observe(_payload_bytes(event.data), kind="stream")
+
+
+def _payload_bytes(value):
+    """Arrays travel as binary buffers, anything else is counted at about 8 bytes per value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_payload_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_payload_bytes(v) for v in value)
+    return 8
+
+
+class MetricsHandler(RequestHandler):
+    """Serves ``/metrics`` for Prometheus to scrape."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(render_metrics())
+
+
+def metrics_patterns():
+    """Tornado route for the metrics endpoint."""
+    return [(r"/metrics", MetricsHandler)]
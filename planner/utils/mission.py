@@ -0,0 +1,158 @@
+import io
+
+import numpy as np
+
+# QGC WPL 110 mission files, as read by Mission Planner and QGroundControl.
+# One tab-separated row per waypoint:
+#   INDEX CURRENT FRAME COMMAND PARAM1 PARAM2 PARAM3 PARAM4 LAT LON ALT AUTOCONTINUE
+# marker_source keeps x (lon), y (lat) and label, plus the columns below once
+# a mission has been loaded, so they survive a load / edit / save round trip.
+
+HEADER = "QGC WPL 110"
+MISSION_COLUMNS = ("frame", "command", "param1", "param2", "param3", "param4", "alt", "autocontinue")
+INT_COLUMNS = ("frame", "command", "autocontinue")
+
+# What new waypoints get when a column is missing, matching what the planner has always written
+DEFAULTS = {
+    "frame": 0,
+    "command": 16,  # MAV_CMD_NAV_WAYPOINT
+    "param1": 0.0,
+    "param2": 0.0,
+    "param3": 0.0,
+    "param4": 0.0,
+    "alt": 100.0,
+    "autocontinue": 1,
+}
+HOME_COMMAND = 3  # Written for the first row when there is no command column
+
+LATLON_DECIMALS = 8  # About a millimetre
+PARAM_DECIMALS = 6
+
+
+def format_waypoints(data):
+    """
+    QGC WPL 110 text for marker_source ``data``, first row as home.
+
+    The text is built as one array of ASCII codes, a row per waypoint and a
+    few columns of bytes per field, with unused bytes left 0 and squeezed
+    out at the end. There is no Python loop or string object per row.
+
+    Raises ValueError naming the first waypoint with a NaN or infinite
+    value, rather than write a coordinate that looks fine but isn't.
+    """
+    num_points = len(data["x"])
+    if num_points == 0:
+        return HEADER + "\n"
+
+    fields = {}
+    for name in MISSION_COLUMNS:
+        if name in data:
+            fields[name] = np.asarray(data[name], dtype=float)
+        else:
+            fields[name] = np.full(num_points, DEFAULTS[name], dtype=float)
+            if name == "command":
+                fields[name][0] = HOME_COMMAND
+
+    current = np.zeros(num_points)
+    current[0] = 1  # Home is the current waypoint
+
+    columns = [
+        current,
+        fields["frame"],
+        fields["command"],
+        fields["param1"],
+        fields["param2"],
+        fields["param3"],
+        fields["param4"],
+        np.asarray(data["y"], dtype=float),
+        np.asarray(data["x"], dtype=float),
+        fields["alt"],
+        fields["autocontinue"],
+    ]
+    decimals = [0, 0, 0] + [PARAM_DECIMALS] * 4 + [LATLON_DECIMALS] * 2 + [PARAM_DECIMALS, 0]
+    names = ["current", "frame", "command", "param1", "param2", "param3", "param4", "y", "x", "alt", "autocontinue"]
+    for name, values in zip(names, columns):
+        bad = np.flatnonzero(~np.isfinite(values))
+        if len(bad):
+            raise ValueError(f"Waypoint {bad[0] + 1} has {name} = {values[bad[0]]}")
+
+    blocks = [_format_column(np.arange(num_points), 0)]
+    for values, places in zip(columns, decimals):
+        blocks += [_TAB, _format_column(values, places)]
+    blocks.append(_NEWLINE)
+    text = np.concatenate([np.broadcast_to(block, (num_points, block.shape[1])) for block in blocks], axis=1)
+    return HEADER + "\n" + text[text != 0].tobytes().decode("ascii")
+
+
+def parse_waypoints(text):
+    """
+    marker_source columns for the waypoints in QGC WPL 110 ``text``.
+
+    Raises ValueError if the text is not a WPL 110 mission, or has NaN or
+    infinite values in it (np.loadtxt would take them).
+    """
+    header, _, body = text.partition("\n")
+    if not header.strip().startswith("QGC WPL"):
+        raise ValueError("Not a QGC WPL mission file")
+    if not body.strip():
+        return {"x": [], "y": [], "label": []}
+
+    rows = np.loadtxt(io.StringIO(body), ndmin=2)
+    if rows.shape[1] != 12:
+        raise ValueError(f"Expected 12 columns per waypoint, got {rows.shape[1]}")
+    bad = np.flatnonzero(~np.isfinite(rows).all(axis=1))
+    if len(bad):
+        raise ValueError(f"Waypoint row {bad[0] + 1} has a value that isn't a finite number")
+    rows = rows[np.argsort(rows[:, 0], kind="stable")]  # Files are normally in order already
+
+    data = {
+        "x": rows[:, 9],
+        "y": rows[:, 8],
+        "label": [str(i + 1) for i in range(len(rows))],
+    }
+    for name, index in zip(MISSION_COLUMNS, (2, 3, 4, 5, 6, 7, 10, 11)):
+        column = rows[:, index]
+        data[name] = column.astype(np.int64) if name in INT_COLUMNS else column
+    return data
+
+
+def write_waypoints(path, data):
+    with open(path, "w") as f:
+        f.write(format_waypoints(data))
+
+
+def read_waypoints(path):
+    with open(path) as f:
+        return parse_waypoints(f.read())
+
+
+def _ascii(text):
+    return np.frombuffer(text.encode("ascii"), dtype=np.uint8)[None, :]
+
+
+_TAB = _ascii("\t")
+_NEWLINE = _ascii("\n")
+
+
+def _format_column(values, decimals):
+    """
+    Format an array with fixed ``decimals`` as ASCII codes, one row per value
+    padded with 0 bytes, or a single row if every value is the same.
+    """
+    if np.all(values == values[0]):
+        # Constant columns (most params, frame, autocontinue) are formatted once and broadcast
+        value = values[0]
+        return _ascii(f"{value:.{decimals}f}" if decimals else str(int(round(value))))
+
+    # Fixed point through integers, one digit column at a time, much faster than float to string conversion
+    scaled = np.round(np.abs(values) * 10**decimals).astype(np.int64)
+    powers = 10 ** np.arange(max(len(str(int(scaled.max()))), decimals + 1) - 1, -1, -1, dtype=np.int64)
+    digits = (scaled[:, None] // powers % 10 + ord("0")).astype(np.uint8)
+    # Leading zeros go, down to the units digit
+    digits[(scaled[:, None] < powers) & (powers > 10**decimals)] = 0
+
+    sign = np.where((values < 0) & (scaled > 0), ord("-"), 0).astype(np.uint8)[:, None]
+    if decimals == 0:
+        return np.hstack([sign, digits])
+    point = np.full((len(values), 1), ord("."), dtype=np.uint8)
+    return np.hstack([sign, digits[:, :-decimals], point, digits[:, -decimals:]])
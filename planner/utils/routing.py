@@ -0,0 +1,302 @@
+import math
+import time
+from collections import deque
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+import config
+from utils.metrics import PLAN_POINTS, PLAN_SECONDS
+
+# Waypoint ordering. Routes are open paths: they start at the first waypoint
+# (home) and end wherever is shortest, there is no leg back.
+
+NEIGHBORS = 8  # Candidate list size, local search only tries joining a waypoint to one of these
+MAX_SEGMENT = 3  # Longest run of waypoints an Or-opt move relocates
+PROGRESS_INTERVAL = 0.25  # Seconds between progress reports from the local search
+
+
+def path_length(points, order):
+    """Length of the open path through ``points`` (n, 2) in ``order``."""
+    if len(order) < 2:
+        return 0.0
+    steps = np.diff(points[np.asarray(order)], axis=0)
+    return float(np.hypot(steps[:, 0], steps[:, 1]).sum())
+
+
+def plan_route(points, time_budget, progress=None, cancel=None):
+    """
+    Initial route plus local search, as a list of indices into ``points``.
+
+    ``progress(length)`` is called with the initial route's length, then
+    every ``PROGRESS_INTERVAL`` seconds and once at the end with the best
+    length so far. Setting the ``cancel`` event stops the search early,
+    still returning the best route found.
+    """
+    PLAN_POINTS.observe(len(points))
+    with PLAN_SECONDS.time():
+        seed = initial_tour(points)
+        if progress is not None:
+            progress(path_length(points, seed))
+        tour = improve_tour(points, seed, time_budget, progress=progress, cancel=cancel)
+    if progress is not None:
+        progress(path_length(points, tour))
+    return tour
+
+
+def initial_tour(points):
+    """
+    Starting route for the local search.
+
+    Small plans get a greedy nearest-neighbour route. Above
+    ``config.TSP_DENSE_MAX_POINTS`` that needs an n x n distance matrix
+    (80 GB at 100k points), so large plans follow a Hilbert curve instead,
+    which only needs a sort.
+    """
+    if len(points) > config.TSP_DENSE_MAX_POINTS:
+        return hilbert_tour(points)
+    return nearest_neighbor_tour(points)
+
+
+def nearest_neighbor_tour(points):
+    """Greedy seed: start at the first point, always fly to the closest unvisited one."""
+    distance_matrix = cdist(points, points, metric="euclidean")
+
+    num_points = len(points)
+    path = []
+    current = 0  # Start at the first point
+    path.append(current)
+    distance_matrix[:, current] = np.inf
+
+    for _ in range(num_points - 1):
+        # Find the nearest neighbor, visited points are at infinity
+        nearest = int(np.argmin(distance_matrix[current]))
+        path.append(nearest)
+        distance_matrix[:, nearest] = np.inf
+        current = nearest
+
+    return path
+
+
+def hilbert_tour(points, order=16):
+    """
+    Visit points in the order of a Hilbert curve over their bounding box,
+    starting from the first point.
+
+    Points close along the curve are close in space, so this is a fair route
+    in O(n log n) with no distance matrix, within ~25% of optimal on spread
+    out points. Unless point 0 sits at an end of the curve, the path has to
+    jump once to get from one side of it to the other. Simply wrapping
+    around costs about the bounding box's side, since that is how far apart
+    the curve's ends are, so the shortest of the three ways to join the two
+    halves is kept.
+    """
+    side = (1 << order) - 1
+    low = points.min(axis=0)
+    span = max(float((points.max(axis=0) - low).max()), np.finfo(float).tiny)
+    x, y = np.round((points - low) / span * side).astype(np.int64).T
+
+    # Classic xy -> d conversion, one bit level at a time for all points
+    d = np.zeros(len(points), dtype=np.int64)
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the sub-curve is in standard orientation
+        flip = ~ry & rx
+        x = np.where(flip, side - x, x)
+        y = np.where(flip, side - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+
+    tour = np.argsort(d, kind="stable")
+    start = int(np.flatnonzero(tour == 0)[0])
+    before, after = tour[:start], tour[start + 1:]
+    candidates = (
+        np.concatenate(([0], after, before)),  # Wrap from the end of the curve to its start
+        np.concatenate(([0], after, before[::-1])),  # Jump from the end of the curve back to just before 0
+        np.concatenate(([0], before[::-1], after)),  # Back to the start of the curve, jump to just after 0
+    )
+    return min(candidates, key=lambda order: path_length(points, order)).tolist()
+
+
+def improve_tour(points, tour, time_budget, focus=None, progress=None, cancel=None):
+    """
+    Shorten an open path with 2-opt and Or-opt moves, keeping ``tour[0]`` first.
+
+    Moves are only tried where they join a waypoint to one of its
+    ``NEIGHBORS`` nearest neighbours, which finds nearly all the gain at a
+    fraction of the cost of trying every pair. Every applied move shortens
+    the path, so stopping when ``time_budget`` seconds run out still returns
+    the best tour found so far. With ``focus``, the search starts from those
+    waypoints and their neighbours only and spreads as far as moves keep
+    paying off, which is a local repair rather than a full pass.
+    ``progress`` and ``cancel`` are as for ``plan_route``.
+    """
+    if len(tour) < 4:
+        return list(tour)
+    search = _LocalSearch(points, tour)
+    return search.run(time.perf_counter() + time_budget, focus, progress, cancel)
+
+
+def extend_tour(points, tour, new):
+    """Insert each waypoint in ``new`` at its cheapest position in the open path ``tour``."""
+    tour = list(tour)
+    for p in new:
+        if not tour:
+            tour.append(p)  # First waypoint is home
+            continue
+        tour.insert(_cheapest_position(points, tour, p), p)
+    return tour
+
+
+def repair_tour(points, tour, moved, time_budget):
+    """
+    Fix up an open path after the waypoints in ``moved`` changed position.
+
+    Each one is cut out and re-inserted at its cheapest position, then the
+    local search runs around them for at most ``time_budget`` seconds.
+    """
+    tour = list(tour)
+    for p in moved:
+        if tour and tour[0] == p:
+            continue  # Home stays first
+        tour.remove(p)
+        tour.insert(_cheapest_position(points, tour, p), p)
+    return improve_tour(points, tour, time_budget, focus=moved)
+
+
+def _cheapest_position(points, tour, p):
+    """Index in ``tour`` to insert ``p`` at that adds the least length, never before home."""
+    path = points[tour]
+    to_p = np.hypot(*(path - points[p]).T)
+    legs = np.hypot(*np.diff(path, axis=0).T)
+    # Inserting after tour[k] for every k, the last one just extends the path
+    cost = np.append(to_p[:-1] + to_p[1:] - legs, to_p[-1])
+    return int(np.argmin(cost)) + 1
+
+
+class _LocalSearch:
+    def __init__(self, points, tour):
+        self.xs = points[:, 0].tolist()
+        self.ys = points[:, 1].tolist()
+        self.tour = list(tour)
+        self.pos = [0] * len(tour)
+        self._index(0, len(tour))
+
+        k = min(NEIGHBORS + 1, len(tour))
+        _, nearest = cKDTree(points).query(points, k=k)
+        self.neighbors = [[c for c in row if c != a] for a, row in enumerate(nearest.tolist())]
+        self.length = path_length(points, tour)
+        self.eps = 1e-12 * max(1.0, self.length)
+
+    def _index(self, start, stop):
+        for i in range(start, stop):
+            self.pos[self.tour[i]] = i
+
+    def d(self, a, b):
+        if a is None or b is None:
+            return 0.0  # Past the open end of the path
+        return math.hypot(self.xs[a] - self.xs[b], self.ys[a] - self.ys[b])
+
+    def at(self, i):
+        return self.tour[i] if i < len(self.tour) else None
+
+    def run(self, deadline, focus=None, progress=None, cancel=None):
+        if focus is None:
+            queue = deque(self.tour)
+        else:
+            queue = deque(dict.fromkeys(c for a in focus for c in (a, *self.neighbors[a])))
+        queued = set(queue)
+        next_report = time.perf_counter() + PROGRESS_INTERVAL
+        while queue:
+            now = time.perf_counter()
+            if now >= deadline or (cancel is not None and cancel.is_set()):
+                break
+            if progress is not None and now >= next_report:
+                progress(self.length)
+                next_report = now + PROGRESS_INTERVAL
+
+            a = queue.popleft()
+            queued.discard(a)
+            touched = self._two_opt(a) or self._or_opt(a)
+            if touched:
+                # Waypoints near the change may have new moves open to them
+                for c in touched:
+                    i = self.pos[c]
+                    for j in (i - 1, i, i + 1):
+                        b = self.at(j) if j >= 0 else None
+                        if b is not None and b not in queued:
+                            queue.append(b)
+                            queued.add(b)
+        return self.tour
+
+    def _two_opt(self, a):
+        """Reverse a stretch of the path so ``a`` links to one of its neighbours."""
+        for c in self.neighbors[a]:
+            p, q = sorted((self.pos[a], self.pos[c]))
+            # New edge a-c either as (t[i], t[j]) or as (t[i+1], t[j+1])
+            for i, j in ((p, q), (p - 1, q - 1)):
+                if i < 0 or j - i < 2:
+                    continue
+                t = self.tour
+                nxt = self.at(j + 1)
+                delta = (self.d(t[i], t[j]) + self.d(t[i + 1], nxt)
+                         - self.d(t[i], t[i + 1]) - self.d(t[j], nxt))
+                if delta < -self.eps:
+                    self.length += delta
+                    t[i + 1:j + 1] = t[j:i:-1]
+                    self._index(i + 1, j + 1)
+                    return (t[i], t[i + 1], t[j])
+        return None
+
+    def _or_opt(self, a):
+        """Move a short run of waypoints starting at ``a`` next to one of ``a``'s neighbours."""
+        t = self.tour
+        p = self.pos[a]
+        if p == 0:
+            return None  # Home stays put
+
+        for length in range(1, MAX_SEGMENT + 1):
+            if p + length > len(t):
+                break
+            last = t[p + length - 1]
+            prev, nxt = t[p - 1], self.at(p + length)
+            removed = self.d(prev, a) + self.d(last, nxt) - self.d(prev, nxt)
+
+            for c in self.neighbors[a]:
+                q = self.pos[c]
+                if p <= q < p + length:
+                    continue
+                # After c, in order: c, a .. last, c_next
+                if q != p - 1:
+                    c_next = self.at(q + 1)
+                    added = self.d(c, a) + self.d(last, c_next) - self.d(c, c_next)
+                    if added - removed < -self.eps:
+                        self.length += added - removed
+                        return self._move(p, length, c, after=True)
+                # Before c, reversed: c_prev, last .. a, c
+                if q >= 1:
+                    c_prev = prev if q == p + length else t[q - 1]
+                    added = self.d(c_prev, last) + self.d(a, c) - self.d(c_prev, c)
+                    if added - removed < -self.eps:
+                        self.length += added - removed
+                        return self._move(p, length, c, after=False)
+        return None
+
+    def _move(self, p, length, c, after):
+        t = self.tour
+        segment = t[p:p + length]
+        del t[p:p + length]
+        q = self.pos[c] - (length if self.pos[c] > p else 0)
+        if after:
+            q += 1
+        else:
+            segment.reverse()
+        t[q:q] = segment
+        # Only waypoints between the old and new spot changed position
+        self._index(min(p, q), max(p, q) + length)
+        return (segment[0], segment[-1], c)
@@ -0,0 +1,53 @@
+import time
+
+from bokeh.plotting import curdoc
+
+import config
+
+
+class UpdateScheduler:
+    """
+    Coalesces bursts of property changes in one session into refreshes at
+    most every ``min_interval_ms`` (default ``config.UPDATE_INTERVAL_MS``).
+
+    Change callbacks call ``request(key, func)`` instead of doing the work.
+    The first request after a quiet spell runs on the next tick, later ones
+    wait for the interval to pass. Each key only keeps its latest request,
+    so a drag that fires dozens of range changes costs one refresh per
+    interval with the newest state, and superseded work never runs. Refresh
+    functions should read the widgets when they run, not capture values.
+    """
+
+    def __init__(self, doc=None, min_interval_ms=None):
+        if min_interval_ms is None:
+            min_interval_ms = config.UPDATE_INTERVAL_MS
+        self.doc = doc
+        self.min_interval = min_interval_ms / 1000
+        self._pending = {}  # key -> func, in the order keys were first requested
+        self._scheduled = False
+        self._last_run = float("-inf")
+
+    def request(self, key, func):
+        """Run ``func`` at the next refresh, replacing anything queued under ``key``."""
+        self._pending[key] = func
+        if self._scheduled:
+            return
+
+        # Callbacks run with curdoc() set to their session, so the document can be found late
+        doc = self.doc or curdoc()
+        self._scheduled = True
+        delay = self._last_run + self.min_interval - time.monotonic()
+        if delay <= 0:
+            doc.add_next_tick_callback(self._flush)
+        else:
+            doc.add_timeout_callback(self._flush, int(delay * 1000))
+
+    def _flush(self):
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        try:
+            for func in pending.values():
+                func()
+        finally:
+            # Timed from the end, so slow refreshes still leave the IO loop a gap
+            self._last_run = time.monotonic()
@@ -0,0 +1,170 @@
+import mmap
+import time
+
+import numpy as np
+from bokeh.document.events import DocumentPatchedEvent
+from tornado.ioloop import PeriodicCallback
+
+import config
+from utils.cache import INDEX_CACHE, RASTER_CACHE
+
+# Per-session resource tracking for this server process. Each session
+# registers the ColumnDataSources holding its data and the cleanup for its
+# background jobs. A periodic check empties the large sources of sessions
+# that have been idle a while, or of the least recently active ones while
+# the process is over its budget, and refills them on the session's next
+# change. Closed sessions are torn down straight away.
+#
+# Sessions are only charged for buffers they own. Images memory-mapped from
+# the shared store or held by the process caches are shared by every
+# session showing them; emptying one session's source wouldn't free them,
+# and the caches already keep them within their own budgets.
+
+CHECK_INTERVAL_MS = 10_000  # How often budgets and idle times are checked
+
+_sessions = {}  # session id -> SessionResources
+_governor = None
+
+
+class SessionResources:
+    """
+    Buffers and background work belonging to one browser session.
+
+    ``track`` sources with a ``rehydrate`` function to let them be emptied
+    while the session is idle, and without one to only count them. Anything
+    that must be stopped when the session closes goes to ``on_teardown``.
+    """
+
+    def __init__(self, session_id, logger):
+        self.session_id = session_id
+        self.logger = logger
+        self.document = None
+        self.last_active = time.monotonic()
+        self.evicted = False
+        self._sources = []  # (source, rehydrate or None)
+        self._teardown = []
+        self._quiet = False  # Set while we change sources ourselves, which isn't activity
+        _sessions[session_id] = self
+
+    def track(self, source, rehydrate=None):
+        self._sources.append((source, rehydrate))
+
+    def on_teardown(self, callback):
+        self._teardown.append(callback)
+
+    def attach(self, document):
+        """Start watching the session's document for activity."""
+        self.document = document
+        document.on_change(self._on_change)
+
+    def nbytes(self):
+        """Bytes owned by every tracked source."""
+        return sum(source_nbytes(source) for source, _ in self._sources)
+
+    def evictable_nbytes(self):
+        if self.evicted:
+            return 0
+        return sum(source_nbytes(source) for source, rehydrate in self._sources if rehydrate is not None)
+
+    def evict(self):
+        """Empty the evictable sources, under the document lock."""
+        if self.document is not None and not self.evicted:
+            self.evicted = True
+            self.document.add_next_tick_callback(self._evict)
+
+    def destroy(self):
+        """Stop background work and drop every buffer. The session is gone, so no lock is needed."""
+        _sessions.pop(self.session_id, None)
+        for callback in self._teardown:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.warning(f"Session teardown step failed: {e}")
+        self._quiet = True
+        for source, _ in self._sources:
+            source.data = {}
+        self._sources.clear()
+        self._teardown.clear()
+        self.document = None
+
+    def _evict(self):
+        if not self.evicted:
+            return  # Woken up before the eviction ran
+        self._quiet = True
+        try:
+            for source, rehydrate in self._sources:
+                if rehydrate is not None:
+                    source.data = {name: [] for name in source.data}
+        finally:
+            self._quiet = False
+        self.logger.info(f"Evicted buffers of idle session {self.session_id}")
+
+    def _on_change(self, event):
+        if self._quiet or not isinstance(event, DocumentPatchedEvent):
+            return  # Our own changes, or callbacks coming and going
+        self.last_active = time.monotonic()
+        if self.evicted:
+            self.evicted = False
+            self.document.add_next_tick_callback(self._rehydrate)
+
+    def _rehydrate(self):
+        for _, rehydrate in self._sources:
+            if rehydrate is not None:
+                rehydrate()
+        self.logger.info(f"Rehydrated session {self.session_id}")
+
+
+def source_nbytes(source):
+    """Approximate bytes in a ColumnDataSource's columns, leaving out shared buffers."""
+    total = 0
+    for column in source.data.values():
+        if isinstance(column, np.ndarray):
+            total += _owned_nbytes(column)
+        else:
+            total += sum(_owned_nbytes(value) if isinstance(value, np.ndarray) else 8 for value in column)
+    return total
+
+
+def _owned_nbytes(array):
+    """``array.nbytes``, or 0 if it is a view of a memory map or of a cached array."""
+    if RASTER_CACHE.holds(array) or INDEX_CACHE.holds(array):
+        return 0
+    nbytes, base = array.nbytes, array
+    while isinstance(base, np.ndarray):
+        if isinstance(base, np.memmap):
+            return 0
+        base = base.base
+    return 0 if isinstance(base, mmap.mmap) else nbytes
+
+
+def session_resources(session_id):
+    return _sessions.get(session_id)
+
+
+def enforce_budgets():
+    """
+    Evict sessions idle for longer than ``config.SESSION_IDLE_SECONDS``, then
+    the least recently active ones until the bytes they own fit in
+    ``config.SESSION_MEMORY_BYTES``. Sessions showing only shared images
+    are left alone, evicting them would free nothing.
+    """
+    now = time.monotonic()
+    sessions = sorted((s for s in _sessions.values() if s.document is not None), key=lambda s: s.last_active)
+    total = sum(s.nbytes() for s in sessions)
+    for session in sessions:
+        idle = now - session.last_active > config.SESSION_IDLE_SECONDS
+        if not idle and total <= config.SESSION_MEMORY_BYTES:
+            break  # Everyone after this is more recently active
+        evictable = session.evictable_nbytes()
+        if evictable:
+            session.evict()
+            total -= evictable
+
+
+def start_governor():
+    """Run ``enforce_budgets`` periodically on the current IO loop. Call once per server process."""
+    global _governor
+    if _governor is None:
+        _governor = PeriodicCallback(enforce_budgets, CHECK_INTERVAL_MS)
+        _governor.start()
+    return _governor
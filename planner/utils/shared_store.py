@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import time
+import uuid
+
+import numpy as np
+from rasterio.coords import BoundingBox
+
+# Host-wide store behind the process caches. Every `bokeh serve --num-procs`
+# worker and decode process keeps its own LRUCache, but the arrays in them
+# are read-only memory maps of files in one directory, so the operating
+# system holds each decoded raster or index layer once per host and every
+# process attaching to it shares those pages.
+#
+# Nothing is unpickled: arrays are .npy files loaded with allow_pickle=False
+# and everything around them is a JSON manifest, so a file planted in the
+# directory can at worst be a wrong value, never code.
+
+FORMAT_VERSION = 1  # Part of every key. Bump when cached values change layout, so old entries are never read.
+STALE_TMP_SECONDS = 600  # Half-written files older than this were left by a crash
+
+# Tuple subclasses that may appear in cached values, by name
+NAMED_TUPLES = {"BoundingBox": BoundingBox}
+
+logger = logging.getLogger("waypoint_planner")
+
+
+def open_shared_store(directory, max_bytes):
+    """
+    SharedStore in ``directory``, or None if it is turned off (``max_bytes``
+    of 0) or the directory is not safe to use.
+
+    The directory is created private to this user. One that already exists
+    must be a real directory owned by this user that nobody else can write
+    to, or another local user could feed the server its values; if others
+    can merely read it, as with one made by an older version, it is closed.
+    """
+    if max_bytes <= 0:
+        return None
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.lstat(directory)
+    except OSError as e:
+        logger.warning(f"Shared raster store disabled, cannot create {directory}: {e}")
+        return None
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        logger.warning(f"Shared raster store disabled, {directory} is not a private directory owned by this user")
+        return None
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    return SharedStore(directory, max_bytes)
+
+
+class SharedStore:
+    """
+    Values (arrays, or tuples holding them) saved under a directory by key.
+
+    ``put`` writes the arrays to .npy files and hands back the value with
+    each one replaced by a read-only ``np.memmap``, which is also what
+    ``get`` returns in any other process. Entries are written under
+    temporary names and renamed into place, so readers never see half a
+    value. Past ``max_bytes``, or the free space on the device if that is
+    smaller, the least recently used entries are deleted; processes that
+    still map them keep their pages until they let go.
+
+    Use ``open_shared_store`` rather than creating one directly.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """Value saved under ``key`` by any process, or None."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            arrays = [
+                np.load(os.path.join(self.directory, name), mmap_mode="r", allow_pickle=False)
+                for name in manifest["arrays"]
+            ]
+            value = _decode(manifest["value"], arrays)
+            os.utime(path)  # Recently used, for eviction
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None  # Missing, being evicted, torn by a crash, or not ours
+        return value
+
+    def put(self, key, value):
+        """
+        Save ``value`` and return it with its arrays memory-mapped from the
+        store. If it can't be saved (out of space, or a type the store
+        doesn't know) the value is handed back unchanged, private to this
+        process.
+        """
+        shared = self.get(key)
+        if shared is not None:
+            return shared  # Another process got there first, keep one copy
+
+        name = self._name(key)
+        arrays = []
+        try:
+            manifest = {"value": _encode(value, arrays), "arrays": []}
+        except TypeError:
+            return value
+
+        if not self._evict(sum(array.nbytes for array in arrays)):
+            return value  # Bigger than the whole store
+        prefix = f"{name}-{uuid.uuid4().hex[:8]}"
+        try:
+            for i, array in enumerate(arrays):
+                filename = f"{prefix}-{i}.npy"
+                # Flipped or strided views are saved as they look, not as they are laid out
+                _write_atomic(os.path.join(self.directory, filename), lambda f: np.save(f, array, allow_pickle=False))
+                manifest["arrays"].append(filename)
+            _write_atomic(self._path(key), lambda f: f.write(json.dumps(manifest).encode()))
+        except OSError as e:
+            # Typically ENOSPC on a small /dev/shm. Drop what was written and carry on without sharing.
+            logger.warning(f"Could not add to the shared raster store: {e}")
+            for filename in manifest["arrays"]:
+                _unlink(os.path.join(self.directory, filename))
+            return value
+
+        shared = self.get(key)
+        return value if shared is None else shared
+
+    def _name(self, key):
+        return hashlib.blake2b(repr((FORMAT_VERSION, key)).encode(), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, self._name(key) + ".json")
+
+    def _evict(self, incoming=0):
+        """Delete least recently used entries until ``incoming`` more bytes fit. False if they never will."""
+        entries = {}  # name -> [mtime of the manifest, total bytes]
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name, ext = os.path.splitext(entry.name)
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue  # Deleted by another process meanwhile
+                if ext == ".tmp":
+                    if now - info.st_mtime > STALE_TMP_SECONDS:
+                        _unlink(entry.path)
+                    continue
+                if ext == ".json":
+                    entries.setdefault(name, [0, 0])[0] = info.st_mtime
+                elif ext == ".npy":
+                    name = name.split("-", 1)[0]
+                else:
+                    continue
+                entries.setdefault(name, [0, 0])[1] += info.st_size
+
+        total = sum(size for _, size in entries.values())
+        try:
+            # /dev/shm in a container is often only 64 MB, whatever the budget says
+            budget = min(self.max_bytes, total + shutil.disk_usage(self.directory).free)
+        except OSError:
+            budget = self.max_bytes
+        for name, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total + incoming <= budget:
+                break
+            self._remove(name)
+            total -= size
+        return total + incoming <= budget
+
+    def _remove(self, name):
+        # The manifest goes first, so nobody starts attaching to arrays about to disappear
+        paths = [os.path.join(self.directory, name + ".json")]
+        paths += [entry.path for entry in os.scandir(self.directory) if entry.name.startswith(name + "-")]
+        for path in paths:
+            _unlink(path)
+
+
+def _encode(value, arrays):
+    """JSON-able description of ``value``, with arrays moved to ``arrays``. TypeError for anything else."""
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError("object arrays can't be shared")
+        arrays.append(value)
+        return {"array": len(arrays) - 1}
+    if isinstance(value, tuple) and type(value) is not tuple:
+        name = type(value).__name__
+        if NAMED_TUPLES.get(name) is not type(value):
+            raise TypeError(f"{name} can't be shared")
+        return {"named": name, "items": [_encode(v, arrays) for v in value]}
+    if isinstance(value, (tuple, list)):
+        return {type(value).__name__: [_encode(v, arrays) for v in value]}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {"value": value}
+    raise TypeError(f"{type(value).__name__} can't be shared")
+
+
+def _decode(encoded, arrays):
+    if "array" in encoded:
+        return arrays[encoded["array"]]
+    if "named" in encoded:
+        return NAMED_TUPLES[encoded["named"]](*(_decode(v, arrays) for v in encoded["items"]))
+    if "tuple" in encoded:
+        return tuple(_decode(v, arrays) for v in encoded["tuple"])
+    if "list" in encoded:
+        return [_decode(v, arrays) for v in encoded["list"]]
+    return encoded["value"]
+
+
+def _write_atomic(path, write):
+    """Call ``write(f)`` on a temporary file, then rename it to ``path``. The temporary file never outlives a failure."""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        _unlink(tmp)
+        raise
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,286 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.coords import BoundingBox
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.windows import Window, from_bounds
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler
+
+import config
+from utils.cache import file_digest
+from utils.disk_cleanup import mark_used
+from utils.geo_utils import band_ranges, open_raster
+
+# Tile pyramid served straight off the Bokeh/Tornado server.
+# Browsers only ever fetch the 256px tiles covering their viewport, so the
+# websocket never carries image data and memory does not scale with the image.
+
+TILE_EXECUTOR = ThreadPoolExecutor(max_workers=config.TILE_WORKERS, thread_name_prefix="tiles")
+
+_pyramids = {}
+_pyramids_lock = threading.Lock()
+_tile_url_prefix = None  # Set once the tile route is mounted on the server
+
+TOUCH_SECONDS = 60  # How often a pyramid in use marks itself used, so the disk cleanup keeps it
+
+
+def _encode_png(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+EMPTY_TILE = _encode_png(np.zeros((config.TILE_SIZE, config.TILE_SIZE, 4), dtype=np.uint8))
+
+
+class TilePyramid:
+    """
+    Fixed-size tile grid over a GeoTIFF, rendered on demand and cached on disk.
+
+    Follows the TMS layout Bokeh's TMSTileSource expects: zoom 0 is a single
+    tile covering the whole image, each level doubles the resolution, and tile
+    rows count up from the bottom edge of the image. Everything needed to
+    render a tile lives in ``meta.json`` so any server process can serve any
+    pyramid.
+    """
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+        self.id = os.path.basename(directory)
+        self.source = meta["source"]
+        self.tile_size = meta["tile_size"]
+        self.max_zoom = meta["max_zoom"]
+        self.indexes = meta["indexes"]
+        self.band_ranges = meta["band_ranges"]  # None for uint8 imagery
+        self.bounds = BoundingBox(*meta["bounds"])
+        self.extent = max(self.bounds.right - self.bounds.left, self.bounds.top - self.bounds.bottom)
+        self.initial_resolution = self.extent / self.tile_size  # Map units per pixel at zoom 0
+        self._touched = 0
+
+    @classmethod
+    def create(cls, directory, source):
+        """Measure the source raster and write the pyramid metadata."""
+        with rasterio.open(source) as src:
+            res = min(abs(src.transform.a), abs(src.transform.e))
+            bounds = src.bounds
+            extent = max(bounds.right - bounds.left, bounds.top - bounds.bottom)
+            max_zoom = max(0, int(np.ceil(np.log2(extent / (config.TILE_SIZE * res)))))
+
+            if src.count >= 4:
+                indexes = [1, 2, 3, 4]
+            elif src.count == 3:
+                indexes = [1, 2, 3]
+            else:
+                indexes = [1, 1, 1]  # Greyscale
+
+            ranges = None if src.dtypes[0] == "uint8" else band_ranges(src, indexes).tolist()
+
+        meta = {
+            "source": os.path.abspath(source),
+            "tile_size": config.TILE_SIZE,
+            "max_zoom": max_zoom,
+            "indexes": indexes,
+            "band_ranges": ranges,
+            "bounds": list(bounds),
+        }
+        pyramid = cls(directory, meta)
+        pyramid._write_meta()
+        return pyramid
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            return cls(directory, json.load(f))
+
+    def _write_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    def touch(self):
+        """
+        Mark the pyramid and its image used, at most every TOUCH_SECONDS.
+        Puts the metadata back if the disk cleanup deleted it meanwhile.
+        """
+        now = time.monotonic()
+        if now - self._touched < TOUCH_SECONDS:
+            return
+        self._touched = now
+        if not mark_used(os.path.join(self.directory, "meta.json")):
+            self._write_meta()
+        mark_used(self.source)
+
+    def tile_range(self, z):
+        """Number of tile columns and rows at zoom ``z`` that overlap the image."""
+        span = self.extent / 2**z
+        cols = int(np.ceil((self.bounds.right - self.bounds.left) / span - 1e-9))
+        rows = int(np.ceil((self.bounds.top - self.bounds.bottom) / span - 1e-9))
+        return max(cols, 1), max(rows, 1)
+
+    def has_tile(self, z, x, y):
+        return 0 <= z <= self.max_zoom and 0 <= x < 2**z and 0 <= y < 2**z
+
+    def tile_bounds(self, z, x, y):
+        span = self.extent / 2**z
+        left = self.bounds.left + x * span
+        bottom = self.bounds.bottom + y * span
+        return left, bottom, left + span, bottom + span
+
+    def tile_path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), f"{y}.png")
+
+    def get_tile(self, z, x, y):
+        """PNG bytes for a tile, rendering and caching it on first request."""
+        cols, rows = self.tile_range(z)
+        if x >= cols or y >= rows:
+            return EMPTY_TILE  # Inside the square grid, but past the image edge
+
+        path = self.tile_path(z, x, y)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        tile = self.render_tile(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(tile)
+        os.replace(tmp_path, path)  # Atomic, so concurrent renders of one tile are harmless
+        return tile
+
+    def render_tile(self, z, x, y):
+        """Read just the part of the raster under one tile, resampled to tile size."""
+        size = self.tile_size
+        left, bottom, right, top = self.tile_bounds(z, x, y)
+
+        src = open_raster(self.source)
+        window = from_bounds(left, bottom, right, top, transform=src.transform)
+        try:
+            clipped = window.intersection(Window(0, 0, src.width, src.height))
+        except WindowError:
+            return EMPTY_TILE
+
+        # Where the clipped window lands inside the tile, in tile pixels
+        scale_x = size / window.width
+        scale_y = size / window.height
+        col = min(size - 1, int(round((clipped.col_off - window.col_off) * scale_x)))
+        row = min(size - 1, int(round((clipped.row_off - window.row_off) * scale_y)))
+        width = min(size - col, max(1, int(round(clipped.width * scale_x))))
+        height = min(size - row, max(1, int(round(clipped.height * scale_y))))
+
+        data = src.read(
+            self.indexes,
+            window=clipped,
+            out_shape=(len(self.indexes), height, width),
+            resampling=Resampling.bilinear,
+        )
+
+        rgba = np.zeros((size, size, 4), dtype=np.uint8)
+        rgba[row:row + height, col:col + width] = self._to_rgba(data)
+        return _encode_png(rgba)
+
+    def _to_rgba(self, data):
+        """Convert a (bands, h, w) read into a top-down (h, w, 4) uint8 image."""
+        rgba = np.empty(data.shape[1:] + (4,), dtype=np.uint8)
+        num_bands = data.shape[0]
+
+        if self.band_ranges is None:
+            for i in range(num_bands):
+                rgba[..., i] = data[i]
+        else:
+            # Stretch with the pyramid-wide ranges so neighbouring tiles match
+            for i, (low, high) in enumerate(self.band_ranges):
+                scale = 255.0 / (high - low) if high > low else 0.0
+                rgba[..., i] = np.nan_to_num(np.clip((data[i] - low) * scale, 0, 255))
+
+        if num_bands == 3:
+            # Fully opaque except where RGB is all 0
+            rgba[..., 3] = np.where((data[0] == 0) & (data[1] == 0) & (data[2] == 0), 0, 255)
+        if self.band_ranges is not None:
+            # Float rasters mark no data as NaN, which shows through like RGB 0 does
+            rgba[..., 3][np.isnan(data).any(axis=0)] = 0
+        return rgba
+
+    def build(self, max_level):
+        """Precompute every tile of the coarsest levels."""
+        for z in range(min(max_level, self.max_zoom) + 1):
+            cols, rows = self.tile_range(z)
+            for x in range(cols):
+                for y in range(rows):
+                    self.get_tile(z, x, y)
+
+
+def get_pyramid(pyramid_id):
+    """Look up a pyramid by id, loading its metadata from disk if needed."""
+    with _pyramids_lock:
+        pyramid = _pyramids.get(pyramid_id)
+        if pyramid is None:
+            directory = os.path.join(config.TILE_CACHE_DIR, pyramid_id)
+            if not os.path.isfile(os.path.join(directory, "meta.json")):
+                return None
+            pyramid = _pyramids[pyramid_id] = TilePyramid.load(directory)
+    pyramid.touch()
+    return pyramid
+
+
+def _open_pyramid(pyramid_id, source, logger):
+    pyramid = get_pyramid(pyramid_id)
+    if pyramid is not None:
+        logger.debug(f"Reusing tile pyramid {pyramid_id}")
+        return pyramid
+
+    directory = os.path.join(config.TILE_CACHE_DIR, pyramid_id)
+    pyramid = TilePyramid.create(directory, source)
+    with _pyramids_lock:
+        _pyramids[pyramid_id] = pyramid
+
+    logger.info(f"Created tile pyramid {pyramid_id} with {pyramid.max_zoom + 1} levels")
+    TILE_EXECUTOR.submit(pyramid.build, config.TILE_PRECOMPUTE_LEVELS)
+    return pyramid
+
+
+def pyramid_for_file(path, logger):
+    """Tile pyramid for a GeoTIFF on the server's disk, shared by anything with the same contents."""
+    return _open_pyramid(file_digest(path), path, logger)
+
+
+class TileHandler(RequestHandler):
+    """Serves ``/tiles/<pyramid>/<z>/<x>/<y>.png``."""
+
+    async def get(self, pyramid_id, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        pyramid = get_pyramid(pyramid_id)
+        if pyramid is None or not pyramid.has_tile(z, x, y):
+            raise HTTPError(404)
+
+        # Rendering reads from disk, keep it off the IO loop
+        tile = await IOLoop.current().run_in_executor(TILE_EXECUTOR, pyramid.get_tile, z, x, y)
+        self.set_header("Content-Type", "image/png")
+        self.set_header("Cache-Control", "public, max-age=86400")
+        self.write(tile)
+
+
+def tile_patterns(prefix=""):
+    """Tornado routes for the tile endpoint. Mounting them enables tiled rendering."""
+    global _tile_url_prefix
+    _tile_url_prefix = prefix.rstrip("/") + "/tiles"
+    return [(r"/tiles/([0-9a-f]+)/(\d+)/(\d+)/(\d+)\.png", TileHandler)]
+
+
+def tiles_enabled():
+    return _tile_url_prefix is not None
+
+
+def tile_url(pyramid):
+    """URL template for a pyramid, in the form TMSTileSource expects."""
+    return f"{_tile_url_prefix}/{pyramid.id}/{{Z}}/{{X}}/{{Y}}.png"
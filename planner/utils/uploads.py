@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from urllib.parse import urlparse
+
+from bokeh.server.util import check_allowlist
+from bokeh.settings import settings
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler, stream_request_body
+
+import config
+from utils.cache import bytes_digest, file_digest, remember_file_digest
+from utils.disk_cleanup import mark_used
+from utils.geo_utils import open_raster, read_file_contents
+from utils.logging_utils import setup_logger
+from utils.tiles import pyramid_for_file
+from utils.viewport import read_view
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")  # Uploads are named by their content digest
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")  # Classic and BigTIFF, both byte orders
+
+_upload_url = None  # Set once the upload route is mounted on the server
+
+
+def upload_path(digest):
+    return os.path.join(config.UPLOAD_DIR, f"{digest}.tif")
+
+
+def spooled_upload(upload_id):
+    """Path of a finished upload, or None if the id is bogus or unknown."""
+    if not UPLOAD_ID.match(upload_id):
+        return None
+    path = upload_path(upload_id)
+    return path if mark_used(path) else None
+
+
+def spool_upload(decoded):
+    """Write uploaded GeoTIFF bytes to the upload dir so rasterio can read them by path."""
+    digest = bytes_digest(decoded)
+    path = upload_path(digest)
+    if not mark_used(path):  # Same bytes, same file
+        os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(decoded)
+        os.replace(tmp_path, path)
+    remember_file_digest(path, digest)
+    return path
+
+
+def load_upload(file_contents, tiled):
+    """Decode and spool a Base64 upload from the FileInput widget, then load it like a file."""
+    logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
+    return load_file(spool_upload(read_file_contents(file_contents, logger)), tiled)
+
+
+def load_file(source, tiled):
+    """
+    Do the expensive first read of a GeoTIFF on the server's disk.
+
+    Runs in the decode executor, possibly in another process, so it only
+    takes and returns plain picklable data:
+    ``(source path, content digest, bounds, first view or None)``.
+    With ``tiled`` the first read is the pyramid setup, which lands on disk.
+    """
+    logger = setup_logger(name="waypoint_planner", log_level=logging.INFO)
+    digest = file_digest(source)
+
+    if tiled:
+        pyramid = pyramid_for_file(source, logger)
+        return source, digest, pyramid.bounds, None
+
+    bounds = open_raster(source).bounds
+    view_image = read_view(source, digest, bounds, config.VIEWPORT_WIDTH, config.VIEWPORT_HEIGHT)
+    return source, digest, bounds, view_image
+
+
+@stream_request_body
+class UploadHandler(RequestHandler):
+    """
+    Streams a raw GeoTIFF request body straight to the upload dir.
+
+    Chunks are written and hashed as they arrive, so a 2 GB upload costs a few
+    chunks of memory rather than the Base64 string, its decoded copy and the
+    MemoryFile the websocket path needs. Replies with the upload id the
+    session then asks to load.
+
+    Only pages from the origins allowed to open the Bokeh websocket may
+    post here, so another site can't make a visitor's browser fill the disk.
+    """
+
+    def prepare(self):
+        if not self._origin_allowed(self.request.headers.get("Origin")):
+            raise HTTPError(403, reason="Origin not allowed")
+        self.request.connection.set_max_body_size(config.UPLOAD_MAX_BYTES)
+        os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+        self._spool = tempfile.NamedTemporaryFile(dir=config.UPLOAD_DIR, suffix=".part", delete=False)
+        self._hasher = hashlib.blake2b(digest_size=16)
+        self._head = b""
+        self._size = 0
+
+    def _origin_allowed(self, origin):
+        """Same check Bokeh applies to websocket connections."""
+        if not origin:
+            return False
+        allowed_hosts = settings.allowed_ws_origin() or getattr(self.application, "websocket_origins", ())
+        return check_allowlist(urlparse(origin).netloc.lower(), allowed_hosts)
+
+    async def data_received(self, chunk):
+        # Tornado waits for this before reading more, so slow disks throttle the client
+        await IOLoop.current().run_in_executor(None, self._write, chunk)
+
+    def _write(self, chunk):
+        if len(self._head) < 4:
+            self._head += chunk[:4]
+        self._spool.write(chunk)
+        self._hasher.update(chunk)
+        self._size += len(chunk)
+
+    def post(self):
+        self._spool.close()
+        if self._head[:4] not in TIFF_MAGIC:
+            self.send_error(400, reason="Not a GeoTIFF")
+            return
+
+        digest = self._hasher.hexdigest()
+        path = upload_path(digest)
+        os.replace(self._spool.name, path)
+        remember_file_digest(path, digest)
+        self.write({"upload_id": digest, "size": self._size})
+
+    put = post
+
+    def on_finish(self):
+        self._discard_spool()
+
+    def on_connection_close(self):
+        self._discard_spool()  # Client gave up halfway
+
+    def _discard_spool(self):
+        spool = getattr(self, "_spool", None)
+        if spool is not None:
+            spool.close()
+            if os.path.exists(spool.name):
+                os.remove(spool.name)
+
+
+def upload_patterns(prefix=""):
+    """Tornado routes for streaming uploads. Mounting them switches sessions to the streaming widget."""
+    global _upload_url
+    _upload_url = prefix.rstrip("/") + "/upload"
+    return [(r"/upload", UploadHandler)]
+
+
+def upload_url():
+    return _upload_url
@@ -0,0 +1,169 @@
+from functools import partial
+
+from bokeh.core.property.descriptors import UnsetValueError
+from rasterio.errors import WindowError
+from rasterio.windows import Window, from_bounds
+
+import config
+from utils.cache import RASTER_CACHE, VIEW_CACHE, file_digest
+from utils.executor import decode_executor
+from utils.geo_utils import band_ranges, extract_image_data, open_raster
+
+VIEW_MARGIN = 0.25  # Extra fraction of the view read on each side, so short pans stay covered
+
+
+def read_view(source, digest, view, width, height):
+    """
+    Read the part of a raster under ``view`` (left, bottom, right, top) at no
+    more than ``width`` x ``height`` pixels.
+
+    Returns ``(image, (x, y, dw, dh))`` ready for an image_rgba glyph, or None
+    if the view misses the raster. Results are cached by (content digest,
+    window, output size): views of the whole raster in the shared
+    RASTER_CACHE, crops only in this process's VIEW_CACHE.
+    """
+    src = open_raster(source)
+    window = from_bounds(*view, transform=src.transform)
+    try:
+        window = window.intersection(Window(0, 0, src.width, src.height))
+    except WindowError:
+        return None
+    window = window.round_offsets().round_lengths()
+    if window.width < 1 or window.height < 1:
+        return None
+
+    # Never upsample past native pixels, the browser does that for free
+    scale = min(1.0, width / window.width, height / window.height)
+    out_size = (max(1, int(window.height * scale)), max(1, int(window.width * scale)))
+    left, bottom, right, top = src.window_bounds(window)
+
+    # Same file and same view (e.g. every new session's first render) decodes once
+    cache_key = (digest, tuple(window.flatten()), out_size)
+    ranges = None
+    if src.dtypes[0] != "uint8":
+        # Stretch with raster-wide ranges so colours hold still while panning
+        ranges = band_ranges(src, [1, 2, 3, 4] if src.count == 4 else [1, 2, 3], digest)
+    full_extent = (window.col_off, window.row_off, window.width, window.height) == (0, 0, src.width, src.height)
+    cache = RASTER_CACHE if full_extent else VIEW_CACHE
+    image = cache.get_or_create(
+        cache_key, partial(extract_image_data, src, window=window, out_size=out_size, ranges=ranges)
+    )
+
+    return image, (left, bottom, right - left, top - bottom)
+
+
+class ViewportImage:
+    """
+    Keeps ``image_source`` showing only the visible part of a raster, read at
+    screen resolution.
+
+    Reads go through rasterio windows with an ``out_shape``, so GDAL only
+    touches the blocks (or overview levels) under the view. Zoomed out you get
+    a screen-sized overview, zoomed in you get native pixels, and the full
+    raster is never decoded. Reads for pans and zooms run in the decode
+    executor, and only the latest one requested is ever shown.
+    """
+
+    def __init__(self, image_source, logger):
+        self.image_source = image_source
+        self.logger = logger
+        self.source = None
+        self.digest = None
+        self.bounds = None
+        self._pending = None  # Debounce timeout handle
+        self._requested = 0  # Bumped for every read and raster switch, older reads are stale
+
+    def open(self, source):
+        """Switch to a new raster file and render its full extent."""
+        digest = file_digest(source)
+        bounds = open_raster(source).bounds
+        self.show(source, digest, bounds, read_view(source, digest, bounds, config.VIEWPORT_WIDTH, config.VIEWPORT_HEIGHT))
+        return bounds
+
+    def show(self, source, digest, bounds, view_image):
+        """Switch to a raster whose first view was already read, e.g. by a background job."""
+        self.source = source
+        self.digest = digest
+        self.bounds = bounds
+        self._requested += 1  # Reads of the old raster still running are of no use now
+        self._update_source(view_image)
+
+    def render(self, view, width=None, height=None):
+        """Read the part of the raster under ``view`` into image_source."""
+        view_image = read_view(
+            self.source, self.digest, view,
+            width or config.VIEWPORT_WIDTH, height or config.VIEWPORT_HEIGHT,
+        )
+        self._update_source(view_image)
+
+    def _update_source(self, view_image):
+        if view_image is None:
+            return  # Looking at empty space, keep what we have
+        image, (x, y, dw, dh) = view_image
+        self.image_source.data = {"image": [image], "x": [x], "y": [y], "dw": [dw], "dh": [dh]}
+        self.logger.debug(f"Viewport image {image.shape[1]}x{image.shape[0]}")
+
+    def watch(self, image_figure):
+        """Re-render, debounced, whenever the figure's ranges change."""
+        callback = partial(self._schedule, image_figure)
+        for fig_range in (image_figure.x_range, image_figure.y_range):
+            fig_range.on_change("start", callback)
+            fig_range.on_change("end", callback)
+
+    def _schedule(self, image_figure, attr, old, new):
+        doc = image_figure.document
+        if doc is None:
+            return
+        if self._pending is not None:
+            try:
+                doc.remove_timeout_callback(self._pending)
+            except ValueError:
+                pass  # Already fired
+        self._pending = doc.add_timeout_callback(partial(self.refresh, image_figure), config.VIEWPORT_DEBOUNCE_MS)
+
+    def refresh(self, image_figure):
+        """Read whatever ``image_figure`` currently shows, e.g. after image_source was emptied."""
+        self._pending = None
+        x_range, y_range = image_figure.x_range, image_figure.y_range
+        if None in (x_range.start, x_range.end, y_range.start, y_range.end):
+            return
+
+        pad_x = (x_range.end - x_range.start) * VIEW_MARGIN
+        pad_y = (y_range.end - y_range.start) * VIEW_MARGIN
+        view = (x_range.start - pad_x, y_range.start - pad_y, x_range.end + pad_x, y_range.end + pad_y)
+
+        # Size the read for the padded view, not just the visible part
+        scale = 1 + 2 * VIEW_MARGIN
+        width, height = _figure_size(image_figure)
+        doc = image_figure.document
+        if doc is None:
+            self.render(view, int(width * scale), int(height * scale))
+            return
+
+        # Reading can take a while on big rasters, keep it off the IO loop and the document lock
+        self._requested += 1
+        job = decode_executor().submit(read_view, self.source, self.digest, view, int(width * scale), int(height * scale))
+        job.add_done_callback(partial(self._read_done, doc, self._requested))
+
+    def _read_done(self, doc, request, job):
+        # Called on a pool thread, add_next_tick_callback is safe from there
+        if request != self._requested:
+            return  # The view moved on while this was read
+        try:
+            view_image = job.result()
+        except Exception as e:
+            self.logger.warning(f"Could not read the viewport image: {e}")
+            return
+        doc.add_next_tick_callback(partial(self._apply, request, view_image))
+
+    def _apply(self, request, view_image):
+        if request == self._requested:
+            self._update_source(view_image)
+
+
+def _figure_size(image_figure):
+    """Plot area size the browser reported, or the configured one until it has."""
+    try:
+        return image_figure.inner_width or config.VIEWPORT_WIDTH, image_figure.inner_height or config.VIEWPORT_HEIGHT
+    except UnsetValueError:
+        return config.VIEWPORT_WIDTH, config.VIEWPORT_HEIGHT
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the app modules the way `bokeh serve planner` does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planner"))
+
+# Keep the caches private to the test process, tests that need a store make their own
+os.environ["PLANNER_SHARED_STORE_BYTES"] = "0"
@@ -0,0 +1,128 @@
+import errno
+import os
+
+import numpy as np
+import pytest
+from rasterio.coords import BoundingBox
+
+from utils import shared_store
+from utils.cache import LRUCache
+from utils.shared_store import SharedStore, open_shared_store
+
+
+def block(kb, value=0):
+    return np.full(kb * 1024, value, dtype=np.uint8)
+
+
+def test_lru_cache_evicts_least_recently_used_past_max_bytes():
+    cache = LRUCache(max_bytes=3 * 1024)
+    for key in "abc":
+        cache.put(key, block(1))
+    cache.get("a")  # Now b is the oldest
+    cache.put("d", block(1))
+    assert "b" not in cache and {"a", "c", "d"} <= set(cache._entries)
+    assert cache.nbytes == 3 * 1024
+
+    cache.put("e", block(2))
+    assert set(cache._entries) == {"d", "e"}
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_lru_cache_hands_back_values_too_big_to_keep():
+    cache = LRUCache(max_bytes=1024)
+    big = block(2)
+    assert cache.put("big", big) is big
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_lru_cache_freezes_values_and_knows_its_arrays():
+    cache = LRUCache(max_bytes=10 * 1024)
+    image, other = cache.put("k", (block(1), block(1))), block(1)
+    assert not image[0].flags.writeable
+    assert cache.holds(image[0]) and cache.holds(image[1][::-1])
+    assert not cache.holds(other)
+    calls = []
+    assert cache.get_or_create("k", lambda: calls.append(1)) is image and not calls
+
+
+@pytest.fixture
+def store(tmp_path):
+    return open_shared_store(str(tmp_path / "store"), 1024 * 1024)
+
+
+def test_shared_store_round_trip_without_pickle(store):
+    value = (np.arange(12, dtype=np.uint32).reshape(3, 4)[::-1], BoundingBox(1.0, 2.0, 3.0, 4.0), "uint8", None)
+    shared = store.put(("raster", "key"), value)
+    assert isinstance(shared[0], np.memmap)
+    np.testing.assert_array_equal(shared[0], value[0])
+    assert shared[1:] == value[1:] and isinstance(shared[1], BoundingBox)
+
+    # A fresh handle, like another process, sees the same value
+    again = SharedStore(store.directory, store.max_bytes).get(("raster", "key"))
+    np.testing.assert_array_equal(again[0], value[0])
+    assert again[1] == value[1]
+
+    names = os.listdir(store.directory)
+    assert all(name.endswith((".json", ".npy")) for name in names)
+
+
+def test_shared_store_ignores_pickles(store):
+    name = store._name(("raster", "evil"))
+    with open(os.path.join(store.directory, name + ".json"), "w") as f:
+        f.write('{"value": {"array": 0}, "arrays": ["evil.npy"]}')
+    np.save(os.path.join(store.directory, "evil.npy"), np.array([object()], dtype=object), allow_pickle=True)
+    assert store.get(("raster", "evil")) is None
+
+    with pytest.raises(TypeError):
+        shared_store._encode(np.array([object()], dtype=object), [])
+    assert store.put(("raster", "object"), {"not": "shareable"}) == {"not": "shareable"}
+
+
+def test_full_store_falls_back_instead_of_raising(store, monkeypatch, caplog):
+    def no_space(*args, **kwargs):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(np, "save", no_space)
+    value = block(4)
+    assert store.put(("raster", "full"), value) is value
+    assert os.listdir(store.directory) == []  # Nothing half-written left behind
+    assert "shared raster store" in caplog.text
+
+    cache = LRUCache(max_bytes=1024 * 1024, shared=store, name="raster")
+    assert cache.put("full", value) is value
+    assert cache.get("full") is value
+
+
+def test_store_evicts_to_its_budget_and_skips_what_never_fits(tmp_path):
+    store = open_shared_store(str(tmp_path / "store"), 3 * 1024 + 512)
+    for i in range(3):
+        store.put(("raster", i), block(1, i))
+        os.utime(store._path(("raster", i)), (i, i))  # Oldest first
+    store.put(("raster", 3), block(1, 3))
+    assert store.get(("raster", 0)) is None
+    assert all(store.get(("raster", i)) is not None for i in (1, 2, 3))
+
+    big = block(8)
+    assert store.put(("raster", "big"), big) is big
+    assert store.get(("raster", "big")) is None
+
+
+def test_store_reclaims_stale_temporary_files(store):
+    stale = os.path.join(store.directory, "abc.npy.1234.tmp")
+    open(stale, "wb").close()
+    os.utime(stale, (0, 0))
+    store.put(("raster", "x"), block(1))
+    assert not os.path.exists(stale)
+
+
+def test_store_needs_a_private_directory(tmp_path):
+    directory = tmp_path / "store"
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    assert open_shared_store(str(directory), 1024) is None
+
+    os.chmod(directory, 0o755)  # Readable by others only, as older versions made it
+    assert open_shared_store(str(directory), 1024) is not None
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+    assert open_shared_store(str(tmp_path / "off"), 0) is None
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from matplotlib import colormaps
+
+from utils.colormaps import code_dtype, colormap_lut, quantize_index, render_codes
+
+
+def test_quantize_index_bins_and_invalid_codes():
+    index = np.array([-1.0, -0.999, 0.0, 0.5, 0.9999, 1.0, -3.0, 2.0, np.nan])
+    codes = quantize_index(index, levels=4)
+    assert codes.dtype == np.uint8
+    assert codes.tolist() == [0, 0, 2, 3, 3, 3, 0, 3, 4]
+
+    valid = np.array([True] * 8 + [True])
+    valid[2] = False
+    assert quantize_index(index, valid, levels=4).tolist() == [0, 0, 4, 3, 3, 3, 0, 3, 4]
+
+
+def test_quantize_index_writes_into_a_flipped_view_and_in_place():
+    index = np.array([[-1.0, 0.0], [0.5, 1.0]], dtype=np.float32)
+    out = np.empty((2, 2), dtype=code_dtype(4096))
+    quantize_index(index, out=out[::-1])
+    assert out.tolist() == [[3072, 4095], [0, 2048]]
+
+    scratch = index.copy()
+    assert quantize_index(scratch, overwrite=True).tolist() == [[0, 2048], [3072, 4095]]
+
+
+def test_colormap_lut_matches_matplotlib():
+    lut = colormap_lut("viridis", levels=8)
+    assert lut.shape == (9,) and lut.dtype == np.uint32
+    assert lut[-1] == 0  # Invalid code is transparent
+    centers = -1 + (np.arange(8) + 0.5) / 4
+    expected = colormaps["viridis"]((centers + 1) / 2, bytes=True)
+    assert (lut[:8].view(np.uint8).reshape(-1, 4)[:, :3] == expected[:, :3]).all()
+    assert not lut.flags.writeable
+
+
+def test_colormap_lut_clips_to_the_range():
+    full = colormap_lut("RdYlGn", levels=8)
+    clipped = colormap_lut("RdYlGn", levels=8, low=-0.5, high=0.5)
+    # Codes centred at -0.875 and -0.625 are below low, 0.625 and 0.875 above high
+    assert clipped[:2].tolist() == [full[0]] * 2
+    assert clipped[6:8].tolist() == [full[7]] * 2
+    assert clipped[2:6].tolist() == full[2:6].tolist()
+
+
+def test_render_codes_is_a_lookup():
+    codes = np.array([[0, 7], [8, 3]], dtype=np.uint8)
+    lut = colormap_lut("plasma", levels=8)
+    assert render_codes(codes, "plasma", levels=8).tolist() == lut[codes].tolist()
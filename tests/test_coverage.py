@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from utils.coverage import lawnmower, polygon_area
+
+SQUARE = ([0, 10, 10, 0], [0, 0, 10, 10])
+
+
+def passes(x, y):
+    """Waypoints grouped by pass (constant x for northward passes), in flight order."""
+    groups = []
+    for xi, yi in zip(x, y):
+        if not groups or not np.isclose(groups[-1][0], xi):
+            groups.append((xi, []))
+        groups[-1][1].append(yi)
+    return groups
+
+
+def test_square_gets_evenly_spaced_back_and_forth_passes():
+    x, y = lawnmower(*SQUARE, spacing=2)
+    groups = passes(x, y)
+    assert [g[0] for g in groups] == pytest.approx([1, 3, 5, 7, 9])
+    for i, (_, ys) in enumerate(groups):
+        expected = np.linspace(0, 10, 6)
+        assert ys == pytest.approx(expected if i % 2 == 0 else expected[::-1])
+
+
+def test_turn_margin_and_overlap():
+    x, y = lawnmower(*SQUARE, spacing=4, overlap=0.5, turn_margin=1)
+    groups = passes(x, y)
+    assert [g[0] for g in groups] == pytest.approx([1, 3, 5, 7, 9])  # 4 * (1 - 0.5) apart
+    assert min(y) == pytest.approx(-1) and max(y) == pytest.approx(11)
+
+
+def test_heading_rotates_the_passes():
+    x, y = lawnmower(*SQUARE, spacing=2, heading=90)
+    # Eastward passes: constant y, alternating direction
+    assert sorted(set(np.round(y, 9))) == pytest.approx([1, 3, 5, 7, 9])
+    assert x[0] == pytest.approx(0) and x[5] == pytest.approx(10) and x[6] == pytest.approx(10)
+
+
+def test_concave_polygon_splits_passes():
+    # A U shape: passes across the notch have two segments
+    xs = [0, 10, 10, 7, 7, 3, 3, 0]
+    ys = [0, 0, 10, 10, 4, 4, 10, 10]
+    x, y = lawnmower(xs, ys, spacing=2, heading=90)
+    top = np.isclose(y, 9)
+    assert np.all((x[top] <= 3 + 1e-9) | (x[top] >= 7 - 1e-9))
+    assert np.any(x[top] <= 3) and np.any(x[top] >= 7)
+
+
+@pytest.mark.parametrize("xs, ys", [([], []), ([0, 1], [0, 1]), ([0, 1, 2], [0, 1, 2])])
+def test_degenerate_polygons_give_nothing(xs, ys):
+    x, y = lawnmower(xs, ys, spacing=1)
+    assert len(x) == len(y) == 0
+
+
+def test_polygon_area():
+    assert polygon_area(np.column_stack(SQUARE).astype(float)) == pytest.approx(100)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from utils.mission import HEADER, format_waypoints, parse_waypoints, read_waypoints, write_waypoints
+
+
+def mission(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "x": np.round(rng.uniform(-180, 180, n), 8),
+        "y": np.round(rng.uniform(-90, 90, n), 8),
+        "label": [str(i + 1) for i in range(n)],
+        "frame": rng.integers(0, 4, n),
+        "command": rng.integers(16, 22, n),
+        "param1": np.round(rng.normal(0, 10, n), 6),
+        "param2": np.zeros(n),
+        "param3": np.round(rng.uniform(-1, 1, n), 6),
+        "param4": np.full(n, -0.5),
+        "alt": np.round(rng.uniform(0, 400, n), 6),
+        "autocontinue": np.ones(n, dtype=np.int64),
+    }
+
+
+@pytest.mark.parametrize("n", [1, 2, 1000])
+def test_write_then_read_gives_the_same_mission(tmp_path, n):
+    data = mission(n)
+    path = tmp_path / "plan.waypoints"
+    write_waypoints(path, data)
+    loaded = read_waypoints(path)
+
+    assert loaded.keys() == data.keys()
+    assert loaded["label"] == data["label"]
+    for name, column in data.items():
+        if name != "label":
+            np.testing.assert_array_equal(loaded[name], column, err_msg=name)
+
+
+def test_new_waypoints_get_defaults_and_home_command():
+    text = format_waypoints({"x": [-3.7, -3.71], "y": [40.4, 40.41], "label": ["1", "2"]})
+    lines = text.splitlines()
+    assert lines[0] == HEADER
+    assert lines[1].split("\t") == [
+        "0", "1", "0", "3", "0.000000", "0.000000", "0.000000", "0.000000",
+        "40.40000000", "-3.70000000", "100.000000", "1",
+    ]
+    assert lines[2].split("\t")[:4] == ["1", "0", "0", "16"]
+
+
+def test_formatting_matches_python(tmp_path):
+    values = np.array([0.0, -0.0, -1e-12, 4e-9, -6e-9, 123456.123456789, -7.5, 1e7])
+    text = format_waypoints({"x": values, "y": values[::-1]})
+    lats = [row.split("\t")[8] for row in text.splitlines()[1:]]
+    lons = [row.split("\t")[9] for row in text.splitlines()[1:]]
+    expected = [f"{v:.8f}" for v in values]
+    # Python writes "-0.00000000" for tiny negatives, the mission file doesn't
+    assert lons == [e.replace("-0.00000000", "0.00000000") for e in expected]
+    assert lats == lons[::-1]
+
+
+def test_parse_rejects_other_files():
+    with pytest.raises(ValueError):
+        parse_waypoints("not a mission\n1 2 3\n")
+    with pytest.raises(ValueError):
+        parse_waypoints(HEADER + "\n0\t1\t0\n")
+    assert parse_waypoints(HEADER + "\n") == {"x": [], "y": [], "label": []}
+
+
+@pytest.mark.parametrize("name, value", [("x", np.nan), ("y", np.inf), ("alt", -np.inf), ("param1", np.nan)])
+def test_non_finite_values_are_not_written(name, value):
+    data = mission(5)
+    data[name] = np.asarray(data[name], dtype=float)
+    data[name][3] = value
+    with pytest.raises(ValueError, match=f"Waypoint 4 has {name}"):
+        format_waypoints(data)
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf"])
+def test_non_finite_values_are_not_read(value):
+    row = ["1", "0", "0", "16", "0", "0", "0", "0", "40.4", "-3.7", "100", "1"]
+    good = "\t".join(["0", "1"] + row[2:])
+    row[9] = value
+    with pytest.raises(ValueError, match="row 2"):
+        parse_waypoints(HEADER + "\n" + good + "\n" + "\t".join(row) + "\n")
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from utils.routing import _LocalSearch, extend_tour, hilbert_tour, improve_tour, path_length, repair_tour
+
+
+def random_points(n, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1, (n, 2))
+
+
+def assert_route(tour, n):
+    assert sorted(tour) == list(range(n))
+    assert tour[0] == 0
+
+
+def test_path_length_is_open():
+    points = np.array([[0, 0], [3, 0], [3, 4]], dtype=float)
+    assert path_length(points, [0, 1, 2]) == pytest.approx(7)
+    assert path_length(points, [0]) == 0
+
+
+@pytest.mark.parametrize("n", [4, 5, 50, 500])
+def test_improve_tour_keeps_home_first_and_never_lengthens(n):
+    points = random_points(n)
+    seed = list(range(n))
+    tour = improve_tour(points, seed, time_budget=5)
+    assert_route(tour, n)
+    assert path_length(points, tour) <= path_length(points, seed) + 1e-12
+
+
+def test_tracked_length_matches_path_length():
+    points = random_points(300, seed=1)
+    start = [0] + np.random.default_rng(1).permutation(np.arange(1, 300)).tolist()
+    search = _LocalSearch(points, start)
+    tour = search.run(deadline=float("inf"))
+    assert_route(tour, 300)
+    assert search.length == pytest.approx(path_length(points, tour))
+    assert search.length < path_length(points, start)
+    assert search.pos == np.argsort(tour).tolist()
+
+
+def test_two_opt_uncrosses_a_path():
+    # Along a line, 0 -> 2 -> 1 -> 3 doubles back; reversing the middle fixes it
+    points = np.array([[0, 0], [1, 0], [2, 0], [3, 0]], dtype=float)
+    search = _LocalSearch(points, [0, 2, 1, 3])
+    assert search._two_opt(1)
+    assert search.tour == [0, 1, 2, 3]
+    assert search.length == pytest.approx(3)
+
+
+def test_or_opt_moves_a_stray_waypoint_back_in_line():
+    # Waypoint 5 sits between 2 and 3 but is flown last
+    points = np.array([[0, 0], [1, 0], [2, 0], [4, 0], [5, 0], [3, 0.1]], dtype=float)
+    tour = [0, 1, 2, 3, 4, 5]
+    search = _LocalSearch(points, tour)
+    assert search._or_opt(5)
+    assert search.tour == [0, 1, 2, 5, 3, 4]
+    assert search.length == pytest.approx(path_length(points, search.tour))
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 1000])
+def test_hilbert_tour_starts_at_home(n):
+    points = random_points(n, seed=2)
+    assert_route(hilbert_tour(points), n)
+
+
+def test_hilbert_tour_skips_the_long_wrap():
+    # Home in the middle of a dense grid: wrapping from the curve's end back to its start would cross the whole box
+    side = np.linspace(0, 1, 32)
+    points = np.stack(np.meshgrid(side, side), axis=-1).reshape(-1, 2)
+    points = np.vstack([[0.5, 0.5], points])
+    tour = hilbert_tour(points)
+    assert_route(tour, len(points))
+    steps = np.hypot(*np.diff(points[tour], axis=0).T)
+    assert steps.max() < 0.9  # The curve's ends are a whole side (1.0) apart
+
+
+def test_repair_tour_reinserts_a_dragged_waypoint():
+    # A straight line flown in order, then waypoint 2 is dragged to the far end
+    points = np.column_stack([np.arange(10, dtype=float), np.zeros(10)])
+    points[2] = [9.5, 0.1]
+    tour = repair_tour(points, range(10), [2], time_budget=1)
+    assert_route(tour, 10)
+    assert tour[-2:] in ([9, 2], [2, 9])
+    assert path_length(points, tour) == pytest.approx(path_length(points, [0, 1, 3, 4, 5, 6, 7, 8, 9, 2]), abs=0.2)
+
+
+def test_repair_tour_keeps_home_first_when_home_moves():
+    points = random_points(50, seed=3)
+    tour = improve_tour(points, list(range(50)), time_budget=1)
+    points[0] = [0.9, 0.9]
+    repaired = repair_tour(points, tour, [0, 7], time_budget=1)
+    assert_route(repaired, 50)
+
+
+def test_extend_tour_slots_new_waypoints_in():
+    points = np.array([[0, 0], [2, 0], [3, 0], [1, 0.1]], dtype=float)
+    assert extend_tour(points, [0, 1, 2], [3]) == [0, 3, 1, 2]
+    assert extend_tour(points, [], [0, 1]) == [0, 1]
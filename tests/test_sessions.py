@@ -0,0 +1,115 @@
+import logging
+import time
+
+import numpy as np
+import pytest
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+
+import config
+from utils import sessions
+from utils.cache import RASTER_CACHE
+from utils.sessions import SessionResources, enforce_budgets, source_nbytes
+
+logger = logging.getLogger("test")
+
+
+def run_callbacks(document):
+    """Run what the session queued with add_next_tick_callback, as the IO loop would."""
+    for callback in list(document.session_callbacks):
+        document.remove_next_tick_callback(callback)
+        callback.callback()
+
+
+@pytest.fixture
+def session():
+    image = ColumnDataSource(data={"image": [np.zeros((100, 100), dtype=np.uint32)]})
+    markers = ColumnDataSource(data={"x": np.zeros(10), "y": np.zeros(10)})
+    document = Document()
+    document.add_root(image)
+    document.add_root(markers)
+
+    resources = SessionResources("test-session", logger)
+    resources.rehydrated = []
+
+    def rehydrate():
+        resources.rehydrated.append(True)
+        image.data = {"image": [np.ones((2, 2), dtype=np.uint32)]}
+
+    resources.track(image, rehydrate)
+    resources.track(markers)
+    resources.attach(document)
+    yield resources, image, markers
+    resources.destroy()
+
+
+def test_evict_empties_only_rehydratable_sources(session):
+    resources, image, markers = session
+    assert resources.evictable_nbytes() == 40_000
+    assert resources.nbytes() == 40_000 + 160
+
+    resources.evict()
+    run_callbacks(resources.document)
+    assert image.data["image"] == []
+    assert len(markers.data["x"]) == 10
+    assert resources.evicted and resources.evictable_nbytes() == 0
+    assert not resources.rehydrated  # Our own eviction isn't activity
+
+
+def test_activity_after_eviction_rehydrates(session):
+    resources, image, markers = session
+    resources.evict()
+    run_callbacks(resources.document)
+
+    markers.data = {"x": np.ones(3), "y": np.ones(3)}
+    assert not resources.evicted
+    run_callbacks(resources.document)
+    assert resources.rehydrated == [True]
+    assert len(image.data["image"]) == 1
+
+
+def test_destroy_runs_teardown_and_drops_buffers(session):
+    resources, image, markers = session
+    stopped = []
+    resources.on_teardown(lambda: stopped.append(True))
+    resources.on_teardown(lambda: 1 / 0)  # A failing step doesn't stop the rest
+    resources.destroy()
+    assert stopped == [True]
+    assert image.data == {} and markers.data == {}
+    assert sessions.session_resources("test-session") is None
+
+
+def test_shared_buffers_are_not_charged():
+    RASTER_CACHE.clear()
+    cached = RASTER_CACHE.put(("test", "image"), np.zeros((100, 100), dtype=np.uint32))
+    owned = np.zeros((100, 100), dtype=np.uint32)
+    try:
+        assert source_nbytes(ColumnDataSource(data={"image": [cached[::-1]]})) == 0
+        assert source_nbytes(ColumnDataSource(data={"image": [owned]})) == owned.nbytes
+    finally:
+        RASTER_CACHE.discard(("test", "image"))
+
+
+def test_memory_mapped_buffers_are_not_charged(tmp_path):
+    path = tmp_path / "image.npy"
+    np.save(path, np.zeros((100, 100), dtype=np.uint32))
+    mapped = np.load(path, mmap_mode="r")
+    assert source_nbytes(ColumnDataSource(data={"image": [np.asarray(mapped)[10:]]})) == 0
+
+
+def test_enforce_budgets_evicts_idle_sessions_only(session, monkeypatch):
+    resources, image, markers = session
+    monkeypatch.setattr(config, "SESSION_MEMORY_BYTES", 10**9)
+    enforce_budgets()
+    assert not resources.evicted
+
+    resources.last_active = time.monotonic() - config.SESSION_IDLE_SECONDS - 1
+    enforce_budgets()
+    assert resources.evicted
+
+
+def test_enforce_budgets_evicts_least_recently_active_over_budget(session, monkeypatch):
+    resources, image, markers = session
+    monkeypatch.setattr(config, "SESSION_MEMORY_BYTES", 1000)
+    enforce_budgets()
+    assert resources.evicted